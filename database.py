@@ -1,12 +1,130 @@
 ### Python file to interact with the database ###
 import sqlite3
-from datetime import datetime as dt
+import threading
+import atexit
+from queue import Queue, Empty
+from contextlib import contextmanager
+from functools import lru_cache
+from itertools import chain
+
+# Connection pools by database path, so the functions below don't need to open and close the database on every call
+_pools = {}
+_poolsLock = threading.Lock()
+
+# The most reader connections a pool opens, writes always go through the single writer connection of the pool
+MAX_READERS = 8
+
+# Settings applied to every new connection, WAL lets the readers run while a write is in progress and only syncs on checkpoints
+PRAGMAS = [
+    'PRAGMA journal_mode=WAL',
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-65536',
+    'PRAGMA mmap_size=268435456',
+    'PRAGMA foreign_keys=ON',
+    'PRAGMA busy_timeout=5000',     # Wait for a lock held by another process instead of failing with 'database is locked'
+    'PRAGMA secure_delete=OFF',     # Deleted content is not overwritten with zeros, some SQLite builds turn this on by default
+]
+
+# Indexes on the columns used for filtering and joining, existing databases get them the first time they are opened
+# (class, sheet_id) covers the lookups of the unused worksheet queries, so they never read the records table itself
+# The date indexes let the latest records and uploads queries stop after the requested amount of rows instead of sorting
+INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_records_class_sheet ON records(class, sheet_id)',
+    'DROP INDEX IF EXISTS idx_records_class',   # Covered by idx_records_class_sheet
+    'CREATE INDEX IF NOT EXISTS idx_records_sheet_id ON records(sheet_id)',
+    'CREATE INDEX IF NOT EXISTS idx_records_teacher ON records(teacher)',
+    'CREATE INDEX IF NOT EXISTS idx_worksheets_name ON worksheets(name)',
+    'CREATE INDEX IF NOT EXISTS idx_worksheets_form ON worksheets(form)',
+    'CREATE INDEX IF NOT EXISTS idx_worksheet_paths_sheet_id ON worksheet_paths(sheet_id)',
+    'CREATE INDEX IF NOT EXISTS idx_class_records_record_id ON class_records(record_id)',
+    'CREATE INDEX IF NOT EXISTS idx_records_use_date ON records(use_date DESC, sheet_id)',
+    'CREATE INDEX IF NOT EXISTS idx_worksheets_last_update ON worksheets(last_update DESC)',
+]
+
+# A meta table keeps the worksheet count up to date with triggers, so reading it doesn't have to scan the worksheets table
+# Existing databases are counted once when the table is added
+COUNTERS = [
+    'CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER)',
+    "INSERT OR IGNORE INTO meta (name, value) VALUES ('worksheets_count', (SELECT COUNT(*) FROM worksheets))",
+    "CREATE TRIGGER IF NOT EXISTS trg_worksheets_insert AFTER INSERT ON worksheets BEGIN UPDATE meta SET value = value + 1 WHERE name = 'worksheets_count'; END",
+    "CREATE TRIGGER IF NOT EXISTS trg_worksheets_delete AFTER DELETE ON worksheets BEGIN UPDATE meta SET value = value - 1 WHERE name = 'worksheets_count'; END",
+]
+
+# Databases created before the foreign keys were declared with ON DELETE CASCADE get the same cleanup from triggers,
+# they run before the delete so the foreign key checks never see the child rows
+CASCADES = [
+    'CREATE TRIGGER IF NOT EXISTS trg_worksheets_cascade BEFORE DELETE ON worksheets BEGIN DELETE FROM worksheet_paths WHERE sheet_id = OLD.sheet_id; DELETE FROM records WHERE sheet_id = OLD.sheet_id; END',
+    'CREATE TRIGGER IF NOT EXISTS trg_records_cascade BEFORE DELETE ON records BEGIN DELETE FROM class_records WHERE record_id = OLD.record_id; END',
+]
+_upgradedPaths = set()
+
+# Bumped whenever the worksheet lookups are cleared, the cached lookups are keyed by it
+_worksheetCacheGeneration = 0
+_worksheetCacheLock = threading.Lock()
+
+# Rows fetched from the cursor at a time by the iter functions
+FETCH_SIZE = 1000
+
+# Rows inserted by one multi-row INSERT statement, kept well below the limit of 999 bound parameters per statement
+# (the widest row has 6 columns, so a chunk binds at most 600 parameters)
+INSERT_CHUNK_SIZE = 100
+
+# The SQL statements are kept as constants, so every call hands the same text to the statement cache of the connection
+# Timestamps are generated by SQLite when the statement runs, in the same local time format the application always used
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+SQL_NOW = f"strftime('{TIMESTAMP_FORMAT}', 'now', 'localtime')"
+SQL_INSERT_WORKSHEETS = "INSERT INTO worksheets (name, description, upload_date, last_update, subject, form) VALUES "
+WORKSHEET_ROW = "(?, ?, ?, COALESCE(?, " + SQL_NOW + "), ?, ?)"
+SQL_INSERT_WORKSHEET = SQL_INSERT_WORKSHEETS + WORKSHEET_ROW
+SQL_INSERT_RECORDS = "INSERT INTO records (sheet_id, use_date, class, teacher) VALUES "
+RECORD_ROW = "(?, ?, ?, ?)"
+SQL_REGISTER_WORKSHEET_USE = SQL_INSERT_RECORDS + "(?, " + SQL_NOW + ", ?, ?)"
+SQL_CHECK_WORKSHEET = "SELECT 1 FROM worksheets WHERE name=? LIMIT 1"
+SQL_GET_WORKSHEET_ID = "SELECT sheet_id FROM worksheets WHERE name=?"
+SQL_GET_WORKSHEET_PATH = "SELECT file_path FROM worksheet_paths WHERE sheet_id=?"
+SQL_GET_WORKSHEET_ID_AND_PATH = "SELECT w.sheet_id, wp.file_path FROM worksheets w INNER JOIN worksheet_paths wp ON wp.sheet_id = w.sheet_id WHERE w.name=? LIMIT 1"
+SQL_GET_LATEST_RECORD_ID = "SELECT MAX(record_id) FROM records"
+SQL_INSERT_WORKSHEET_PATHS = "INSERT INTO worksheet_paths (sheet_id, file_path) VALUES "
+WORKSHEET_PATH_ROW = "(?, ?)"
+SQL_INSERT_WORKSHEET_PATH = SQL_INSERT_WORKSHEET_PATHS + WORKSHEET_PATH_ROW
+SQL_INSERT_LAST_WORKSHEET_PATH = SQL_INSERT_WORKSHEET_PATHS + "(last_insert_rowid(), ?)"
+# One UPDATE statement per column of the worksheets table that can be edited, the column name is never formatted into SQL at call time
+SQL_UPDATE_WORKSHEET = {column: f"UPDATE worksheets SET {column}=? WHERE sheet_id=?" for column in ('name', 'description', 'upload_date', 'last_update', 'subject', 'form')}
+SQL_INSERT_CLASS_RECORDS = "INSERT INTO class_records (record_id, section, substituted_teacher) VALUES "
+CLASS_RECORD_ROW = "(?, ?, ?)"
+SQL_INSERT_LAST_CLASS_RECORD = SQL_INSERT_CLASS_RECORDS + "(last_insert_rowid(), ?, ?)"
+SQL_NOT_USED_BY_CLASS = "NOT EXISTS (SELECT 1 FROM records r WHERE r.class = ? AND r.sheet_id = w.sheet_id)"
+SQL_FIND_UNUSED_WORKSHEETS = "SELECT w.name, w.description, w.subject, w.form FROM worksheets w WHERE " + SQL_NOT_USED_BY_CLASS
+SQL_FIND_UNUSED_WORKSHEETS_MATCH_CLASS = "SELECT DISTINCT w.name, w.description, w.subject, w.form FROM worksheets w WHERE w.form IN (?, ?, 'All') AND " + SQL_NOT_USED_BY_CLASS + " ORDER BY w.name"
+SQL_LATEST_RECORDS = "SELECT r.teacher, r.class, w.name, r.use_date AS worksheet_name FROM records r INNER JOIN worksheets w ON r.sheet_id = w.sheet_id ORDER BY r.use_date DESC LIMIT ?"
+SQL_LATEST_UPLOADS = "SELECT w.name, w.subject, w.form, w.last_update FROM worksheets w ORDER BY w.last_update DESC LIMIT ?"
+SQL_COUNT_WORKSHEETS = "SELECT value FROM meta WHERE name = 'worksheets_count'"
+SQL_COUNT_WORKSHEET_ROWS = "SELECT COUNT(*) FROM worksheets"
+SQL_GET_WORKSHEETS = "SELECT sheet_id, name, description, upload_date, last_update, subject, form FROM worksheets"
+SQL_GET_RECORDS = "SELECT record_id, sheet_id, use_date, class, teacher FROM records"
+SQL_GET_CLASS_RECORDS = "SELECT class_record_id, record_id, section, substituted_teacher FROM class_records"
+SQL_GET_RECORDS_BY_CLASS = "SELECT record_id, sheet_id, use_date, class, teacher FROM records WHERE class=?"
+SQL_GET_RECORDS_BY_TEACHER = "SELECT record_id, sheet_id, use_date, class, teacher FROM records WHERE teacher=?"
+SQL_GET_WORKSHEET_PATHS = "SELECT path_id, sheet_id, file_path FROM worksheet_paths"
+SQL_GET_USAGE_DETAILS = "SELECT r.record_id, r.class, r.teacher, w.name, r.use_date, cr.section, cr.substituted_teacher FROM records r LEFT JOIN class_records cr ON r.record_id = cr.record_id INNER JOIN worksheets w ON r.sheet_id = w.sheet_id"
+SQL_GET_USAGE_DETAILS_SINCE = SQL_GET_USAGE_DETAILS + " WHERE r.use_date >= ? ORDER BY r.use_date DESC LIMIT ? OFFSET ?"
+SQL_CLEAR_WORKSHEETS = "DELETE FROM worksheets"
+SQL_CLEAR_RECORDS = "DELETE FROM records"
+SQL_CLEAR_WORKSHEET_PATHS = "DELETE FROM worksheet_paths"
+SQL_CLEAR_CLASS_RECORDS = "DELETE FROM class_records"
+SQL_REMOVE_RECORD = "DELETE FROM records WHERE record_id=?"
+SQL_REMOVE_WORKSHEET = "DELETE FROM worksheets WHERE sheet_id=?"
+SQL_REMOVE_WORKSHEET_PATH = "DELETE FROM worksheet_paths WHERE sheet_id=?"
 
 # Function to create the database
 # The database have two tables, one for the worksheets and another for the records of usage
 # For the worksheets table, the columns are: sheet_id, name, description, upload_date, last_update, subject, form and teacher
 # For the records table, the columns are: record_id, sheet_id (as foreign key), use_date, class, teacher
 
+# The first character of the class names that belong to the junior stage
+JUNIOR_FORMS = frozenset('123')
+
 def findFormByClass(class_name: str) -> str:
     """
     Find the form of a class by its name
@@ -17,8 +135,7 @@ def findFormByClass(class_name: str) -> str:
     Returns:
         str: The form of the class
     """
-    splited = list(class_name)
-    return 'Form ' + splited[0]
+    return 'Form ' + class_name[0]
 
 def findStageByClass(class_name: str) -> str:
     """
@@ -30,8 +147,273 @@ def findStageByClass(class_name: str) -> str:
     Returns:
         str: The stage of the class
     """
-    splited = list(class_name)
-    return 'Junior' if splited[0] == '1' or splited[0] == '2' or splited[0] == '3' else 'Senior'
+    return 'Junior' if class_name[:1] in JUNIOR_FORMS else 'Senior'
+
+class _SQLitePool:
+    """
+    A pool of connections to one database, made of one writer connection and up to MAX_READERS reader connections
+
+    The writer is guarded by a lock so only one thread writes at a time, the readers are opened with query_only
+    and handed out through a queue, with WAL they can read in parallel to each other and to the writer
+    """
+    def __init__(self, d_path: str):
+        self.d_path = d_path
+        self._writeLock = threading.Lock()
+        self._readers = Queue(maxsize=MAX_READERS)
+        self._readerCount = 0
+        self._readerCountLock = threading.Lock()
+        self._writer = self._connect()
+        self._tryUpgrade()
+
+    def _tryUpgrade(self) -> None:
+        """
+        Upgrade the schema of the database if it hasn't been upgraded yet, the caller must hold the writer
+
+        A failed upgrade is rolled back and tried again on the next write, it fails while the tables are not created yet
+        (createDatabase upgrades them itself), while a table of a newer version is missing, or while another process holds the lock
+
+        Returns:
+            None
+        """
+        if self.d_path in _upgradedPaths:
+            return
+        try:
+            with _transaction(self._writer):
+                _upgradeSchema(self._writer)
+            _upgradedPaths.add(self.d_path)
+        except sqlite3.OperationalError:
+            pass
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open a new connection to the database with the PRAGMAS applied
+
+        Returns:
+            sqlite3.Connection: The new connection
+        """
+        conn = sqlite3.connect(self.d_path, cached_statements=256, isolation_level=None, check_same_thread=False)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    @contextmanager
+    def writer(self):
+        """
+        Hold the writer connection for the with block, other threads wait until the block is finished
+
+        Returns:
+            sqlite3.Connection: The writer connection
+        """
+        with self._writeLock:
+            self._tryUpgrade()
+            yield self._writer
+
+    @contextmanager
+    def reader(self):
+        """
+        Take a reader connection for the with block and return it to the pool afterwards,
+        a new reader is opened if none is free and the pool is not full yet, otherwise this waits for one
+
+        Returns:
+            sqlite3.Connection: A reader connection
+        """
+        try:
+            conn = self._readers.get_nowait()
+        except Empty:
+            conn = self._openReader()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def _openReader(self) -> sqlite3.Connection:
+        """
+        Open a new reader connection, or wait for a free one if MAX_READERS are already open
+
+        Returns:
+            sqlite3.Connection: A reader connection
+        """
+        with self._readerCountLock:
+            full = self._readerCount >= MAX_READERS
+            if not full:
+                self._readerCount += 1
+        if full:
+            return self._readers.get()
+        conn = self._connect()
+        conn.execute('PRAGMA query_only=1')
+        return conn
+
+    def close(self) -> None:
+        """
+        Close the writer and the readers that are not borrowed at the moment
+
+        Returns:
+            None
+        """
+        with self._writeLock:
+            self._writer.close()
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except Empty:
+                break
+
+def _getPool(d_path: str) -> _SQLitePool:
+    """
+    Get the connection pool of the database, the pool is created on first use
+
+    Args:
+        d_path (str): The path to the database
+
+    Returns:
+        _SQLitePool: The connection pool of the database
+    """
+    pool = _pools.get(d_path)
+    if pool is None:
+        with _poolsLock:
+            pool = _pools.get(d_path)
+            if pool is None:
+                pool = _pools[d_path] = _SQLitePool(d_path)
+    return pool
+
+def closeConnections() -> None:
+    """
+    Close the connections of all databases, the next call on a database opens it again
+
+    This runs at exit, closing the last connection checkpoints the WAL file back into the database
+
+    Returns:
+        None
+    """
+    with _poolsLock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+atexit.register(closeConnections)
+
+@contextmanager
+def _reading(d_path: str):
+    """
+    Borrow a reader connection of the database for the with block
+
+    Args:
+        d_path (str): The path to the database
+
+    Returns:
+        sqlite3.Connection: A reader connection
+    """
+    with _getPool(d_path).reader() as conn:
+        yield conn
+
+@contextmanager
+def _writing(d_path: str):
+    """
+    Hold the writer connection of the database and run the with block in one write transaction
+
+    Args:
+        d_path (str): The path to the database
+
+    Returns:
+        sqlite3.Connection: The writer connection
+    """
+    with _getPool(d_path).writer() as conn, _transaction(conn):
+        yield conn
+
+def _upgradeSchema(conn: sqlite3.Connection) -> None:
+    """
+    Create the missing indexes, counters and, for databases without ON DELETE CASCADE, the cascade triggers
+
+    Args:
+        conn (sqlite3.Connection): The connection to the database
+
+    Returns:
+        None
+    """
+    for statement in chain(INDEXES, COUNTERS):
+        conn.execute(statement)
+    if not any(fk[6] == 'CASCADE' for fk in conn.execute('PRAGMA foreign_key_list(worksheet_paths)')):
+        for statement in CASCADES:
+            conn.execute(statement)
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection):
+    """
+    Run the statements of the with block in one write transaction, the transaction is rolled back if any of them fails
+
+    The write lock is taken at the start with BEGIN IMMEDIATE, so a transaction never fails halfway because another connection is writing
+
+    Args:
+        conn (sqlite3.Connection): The connection to run the transaction on
+
+    Returns:
+        sqlite3.Connection: The same connection, for use in the with statement
+    """
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield conn
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+def _insertRows(conn: sqlite3.Connection, statement: str, placeholder: str, rows: list[tuple]) -> None:
+    """
+    Insert the rows with multi-row INSERT statements of INSERT_CHUNK_SIZE rows each,
+    the remaining rows are inserted with the single row statement
+
+    Args:
+        conn (sqlite3.Connection): The connection to execute the statements with
+        statement (str): The INSERT statement up to and including VALUES
+        placeholder (str): The placeholder of a single row, e.g. '(?, ?)'
+        rows (list[tuple]): The rows to insert
+
+    Returns:
+        None
+    """
+    rows = list(rows)
+    chunkStatement = statement + ', '.join([placeholder] * INSERT_CHUNK_SIZE)
+    chunked = len(rows) - len(rows) % INSERT_CHUNK_SIZE
+    for i in range(0, chunked, INSERT_CHUNK_SIZE):
+        conn.execute(chunkStatement, tuple(chain.from_iterable(rows[i:i + INSERT_CHUNK_SIZE])))
+    conn.executemany(statement + placeholder, rows[chunked:])
+
+def _iterRows(d_path: str, statement: str, parameters: tuple = ()):
+    """
+    Run a SELECT statement on a reader connection and yield its rows one at a time, they are fetched FETCH_SIZE rows at a time,
+    the reader is returned to the pool once the rows are exhausted or the generator is closed
+
+    Args:
+        d_path (str): The path to the database
+        statement (str): The SELECT statement
+        parameters (tuple): The parameters of the statement
+
+    Returns:
+        Iterator[tuple]: The rows of the result
+    """
+    with _reading(d_path) as conn:
+        cursor = conn.execute(statement, parameters)
+        while rows := cursor.fetchmany(FETCH_SIZE):
+            yield from rows
+
+def _clearWorksheetCaches() -> None:
+    """
+    Clear the cached worksheet lookups, this must be called after any change on the worksheets or worksheet_paths tables
+
+    The generation is part of the cache keys, so a lookup that read the old rows and finishes after this
+    stores its result under the old generation, where it is never found again
+
+    Returns:
+        None
+    """
+    global _worksheetCacheGeneration
+    with _worksheetCacheLock:
+        _worksheetCacheGeneration += 1
+    _checkWorksheetCached.cache_clear()
+    _getWorksheetIdCached.cache_clear()
+    _getWorksheetPathCached.cache_clear()
+    _getWorksheetIdAndPathCached.cache_clear()
 
 def createDatabase(d_path: str) -> None:
     """
@@ -48,19 +430,17 @@ def createDatabase(d_path: str) -> None:
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE worksheets
-                 (sheet_id INTEGER PRIMARY KEY, name TEXT, description TEXT, upload_date TEXT, last_update TEXT, subject TEXT, form TEXT)''')
-    c.execute('''CREATE TABLE records
-                 (record_id INTEGER PRIMARY KEY, sheet_id INTEGER, use_date TEXT, class TEXT, teacher TEXT)''')
-    c.execute('''CREATE TABLE worksheet_paths 
-                 (path_id INTEGER PRIMARY KEY, sheet_id INTEGER, file_path TEXT, FOREIGN KEY (sheet_id) REFERENCES worksheets(sheet_id))''')
-    c.execute('''CREATE TABLE class_records
-                 (class_record_id INTEGER PRIMARY KEY, record_id INTEGER, section INTEGER, substituted_teacher TEXT, FOREIGN KEY (record_id) REFERENCES records(record_id))''')
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        conn.execute(f'''CREATE TABLE worksheets
+                     (sheet_id INTEGER PRIMARY KEY, name TEXT, description TEXT, upload_date TEXT, last_update TEXT DEFAULT ({SQL_NOW}), subject TEXT, form TEXT)''')
+        conn.execute(f'''CREATE TABLE records
+                     (record_id INTEGER PRIMARY KEY, sheet_id INTEGER, use_date TEXT DEFAULT ({SQL_NOW}), class TEXT, teacher TEXT, FOREIGN KEY (sheet_id) REFERENCES worksheets(sheet_id) ON DELETE CASCADE)''')
+        conn.execute('''CREATE TABLE worksheet_paths 
+                     (path_id INTEGER PRIMARY KEY, sheet_id INTEGER, file_path TEXT, FOREIGN KEY (sheet_id) REFERENCES worksheets(sheet_id) ON DELETE CASCADE)''')
+        conn.execute('''CREATE TABLE class_records
+                     (class_record_id INTEGER PRIMARY KEY, record_id INTEGER, section INTEGER, substituted_teacher TEXT, FOREIGN KEY (record_id) REFERENCES records(record_id) ON DELETE CASCADE)''')
+        _upgradeSchema(conn)
+    _upgradedPaths.add(d_path)
 
 def createClassRecordTable(d_path: str) -> None:
     """
@@ -76,15 +456,13 @@ def createClassRecordTable(d_path: str) -> None:
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE class_records
-                 (class_record_id INTEGER PRIMARY KEY, record_id INTEGER, section INTEGER, substituted_teacher TEXT, FOREIGN KEY (record_id) REFERENCES records(record_id))''')
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        conn.execute('''CREATE TABLE class_records
+                     (class_record_id INTEGER PRIMARY KEY, record_id INTEGER, section INTEGER, substituted_teacher TEXT, FOREIGN KEY (record_id) REFERENCES records(record_id) ON DELETE CASCADE)''')
+        _upgradeSchema(conn)    # The indexes couldn't be created without the table
+    _upgradedPaths.add(d_path)
 
-def insertWorksheet(d_path:str, name:str, description:str, upload_date:str, subject:str, form:str, last_update = dt.now().strftime('%Y-%m-%d %H:%M:%S')) -> None:
+def insertWorksheet(d_path:str, name:str, description:str, upload_date:str, subject:str, form:str, last_update: str | None = None) -> None:
     """
     Insert a new worksheet in the database
 
@@ -95,17 +473,28 @@ def insertWorksheet(d_path:str, name:str, description:str, upload_date:str, subj
         upload_date (str): The date of the upload
         subject (str): The subject of the worksheet
         form (str): The form of the worksheet
-        last_update (str): The date of the last update
+        last_update (str | None): The date of the last update, the current time if None
 
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("INSERT INTO worksheets (name, description, upload_date, last_update, subject, form) VALUES (?, ?, ?, ?, ?, ?)", (name, description, upload_date, last_update, subject, form))
-    c.close()
-    conn.commit()
-    conn.close()
+    insertWorksheets(d_path, [(name, description, upload_date, last_update, subject, form)])
+
+def insertWorksheets(d_path: str, rows: list[tuple]) -> None:
+    """
+    Insert multiple worksheets in the database within a single transaction
+
+    Args:
+        d_path (str): The path to the database
+        rows (list[tuple]): The worksheets to insert, each as (name, description, upload_date, last_update, subject, form),
+            a last_update of None is replaced by the current time
+
+    Returns:
+        None
+    """
+    with _writing(d_path) as conn:
+        _insertRows(conn, SQL_INSERT_WORKSHEETS, WORKSHEET_ROW, rows)
+    _clearWorksheetCaches()
 
 def checkWorksheet(d_path: str, name: str) -> bool:
     """
@@ -118,12 +507,13 @@ def checkWorksheet(d_path: str, name: str) -> bool:
     Returns:
         bool: True if the worksheet exists, False otherwise
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT * FROM worksheets WHERE name=?", (name,))
-    worksheet = c.fetchone()
-    conn.close()
-    return worksheet
+    return _checkWorksheetCached(d_path, name, _worksheetCacheGeneration)
+
+@lru_cache(maxsize=256)
+def _checkWorksheetCached(d_path: str, name: str, generation: int) -> bool:
+    with _reading(d_path) as conn:
+        worksheet = conn.execute(SQL_CHECK_WORKSHEET, (name,)).fetchone()
+    return worksheet is not None
 
 def getWorksheetId(d_path: str, name: str) -> int:
     """
@@ -136,11 +526,12 @@ def getWorksheetId(d_path: str, name: str) -> int:
     Returns:
         int: The id of the worksheet
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT sheet_id FROM worksheets WHERE name=?", (name,))
-    sheet_id = c.fetchone()
-    conn.close()
+    return _getWorksheetIdCached(d_path, name, _worksheetCacheGeneration)
+
+@lru_cache(maxsize=256)
+def _getWorksheetIdCached(d_path: str, name: str, generation: int) -> int:
+    with _reading(d_path) as conn:
+        sheet_id = conn.execute(SQL_GET_WORKSHEET_ID, (name,)).fetchone()
     return sheet_id[0]
 
 def getLatestRecordId(d_path: str) -> int:
@@ -153,11 +544,8 @@ def getLatestRecordId(d_path: str) -> int:
     Returns:
         int: The id of the latest record
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT record_id FROM records ORDER BY record_id DESC LIMIT 1")
-    record_id = c.fetchone()
-    conn.close()
+    with _reading(d_path) as conn:
+        record_id = conn.execute(SQL_GET_LATEST_RECORD_ID).fetchone()
     return record_id[0]
 
 def alterWorksheetDateById(d_path: str, sheet_id: int, upload_date: str) -> None:
@@ -172,12 +560,9 @@ def alterWorksheetDateById(d_path: str, sheet_id: int, upload_date: str) -> None
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("UPDATE worksheets SET upload_date=? WHERE sheet_id=?", (upload_date, sheet_id))
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        conn.execute(SQL_UPDATE_WORKSHEET['upload_date'], (upload_date, sheet_id))
+    _clearWorksheetCaches()
 
 def insertWorksheetPath(d_path: str, sheet_id: int, file_path: str) -> None:
     """
@@ -191,14 +576,24 @@ def insertWorksheetPath(d_path: str, sheet_id: int, file_path: str) -> None:
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("INSERT INTO worksheet_paths (sheet_id, file_path) VALUES (?, ?, ?)", (sheet_id, file_path))
-    c.close()
-    conn.commit()
-    conn.close()
+    insertWorksheetPaths(d_path, [(sheet_id, file_path)])
 
-def insertWorksheetAndPath(d_path: str, name: str, description: str, upload_date: str, subject: str, form: str, file_path: str, last_update = dt.now().strftime('%Y-%m-%d %H:%M:%S')):
+def insertWorksheetPaths(d_path: str, rows: list[tuple]) -> None:
+    """
+    Insert multiple worksheet paths in the database within a single transaction
+
+    Args:
+        d_path (str): The path to the database
+        rows (list[tuple]): The worksheet paths to insert, each as (sheet_id, file_path)
+
+    Returns:
+        None
+    """
+    with _writing(d_path) as conn:
+        _insertRows(conn, SQL_INSERT_WORKSHEET_PATHS, WORKSHEET_PATH_ROW, rows)
+    _clearWorksheetCaches()
+
+def insertWorksheetAndPath(d_path: str, name: str, description: str, upload_date: str, subject: str, form: str, file_path: str, last_update: str | None = None):
     """
     Insert a new worksheet and its path in the database
     
@@ -210,19 +605,30 @@ def insertWorksheetAndPath(d_path: str, name: str, description: str, upload_date
         subject (str): The subject of the worksheet
         form (str): The form of the worksheet
         file_path (str): The path to the worksheet
-        last_update (str): The date of the last update
+        last_update (str | None): The date of the last update, the current time if None
         
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("INSERT INTO worksheets (name, description, upload_date, last_update, subject, form) VALUES (?, ?, ?, ?, ?, ?)", (name, description, upload_date, last_update, subject, form))
-    sheet_id = c.lastrowid  # Get the last row id
-    c.execute("INSERT INTO worksheet_paths (sheet_id, file_path) VALUES (?, ?)", (sheet_id, file_path))
-    c.close()
-    conn.commit()
-    conn.close()
+    insertWorksheetsAndPaths(d_path, [(name, description, upload_date, last_update, subject, form, file_path)])
+
+def insertWorksheetsAndPaths(d_path: str, rows: list[tuple]) -> None:
+    """
+    Insert multiple worksheets and their paths in the database within a single transaction
+
+    Args:
+        d_path (str): The path to the database
+        rows (list[tuple]): The worksheets to insert, each as (name, description, upload_date, last_update, subject, form, file_path),
+            a last_update of None is replaced by the current time
+
+    Returns:
+        None
+    """
+    with _writing(d_path) as conn:
+        for *worksheet, file_path in rows:
+            conn.execute(SQL_INSERT_WORKSHEET, worksheet)
+            conn.execute(SQL_INSERT_LAST_WORKSHEET_PATH, (file_path,))    # The path row refers to the worksheet inserted just above
+    _clearWorksheetCaches()
 
 def findUnusedWorksheets(d_path: str, class_name: str) -> list:
     """
@@ -235,11 +641,8 @@ def findUnusedWorksheets(d_path: str, class_name: str) -> list:
     Returns:
         list: A list with all unused worksheets
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT name, description, subject, form FROM worksheets WHERE sheet_id NOT IN (SELECT sheet_id FROM records WHERE class=?)", (class_name,))
-    worksheets = c.fetchall()
-    conn.close()
+    with _reading(d_path) as conn:
+        worksheets = conn.execute(SQL_FIND_UNUSED_WORKSHEETS, (class_name,)).fetchall()
     return worksheets
 
 def findUnusedWorksheetsMatchClass(d_path: str, class_name: str) -> list:
@@ -253,14 +656,11 @@ def findUnusedWorksheetsMatchClass(d_path: str, class_name: str) -> list:
     Returns:
         list: A list with all unused worksheets that match the class form
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT name, description, subject, form FROM worksheets WHERE sheet_id NOT IN (SELECT sheet_id FROM records WHERE class=?) INTERSECT SELECT name, description, subject, form FROM worksheets WHERE form = ? OR form = ? OR form = 'All'", (class_name, findFormByClass(class_name), findStageByClass(class_name),))
-    worksheets = c.fetchall()
-    conn.close()
+    with _reading(d_path) as conn:
+        worksheets = conn.execute(SQL_FIND_UNUSED_WORKSHEETS_MATCH_CLASS, (findFormByClass(class_name), findStageByClass(class_name), class_name)).fetchall()
     return worksheets
 
-def registerWorksheetUse(d_path: str, sheet_id: int, class_name: str, teacher: str) -> None:
+def registerWorksheetUse(d_path: str, sheet_id: int, class_name: str, teacher: str) -> int:
     """
     Register the use of a worksheet in the database
     
@@ -270,16 +670,46 @@ def registerWorksheetUse(d_path: str, sheet_id: int, class_name: str, teacher: s
         class_name (str): The class name
         teacher (str): The teacher name
     
+    Returns:
+        int: The id of the new record
+    """
+    with _writing(d_path) as conn:
+        record_id = conn.execute(SQL_REGISTER_WORKSHEET_USE, (sheet_id, class_name, teacher)).lastrowid
+    return record_id
+
+def registerWorksheetUseWithClassRecord(d_path: str, sheet_id: int, class_name: str, teacher: str, class_record: tuple | None = None) -> int:
+    """
+    Register the use of a worksheet together with its class record within a single transaction
+
+    Args:
+        d_path (str): The path to the database
+        sheet_id (int): The id of the worksheet
+        class_name (str): The class name
+        teacher (str): The teacher name
+        class_record (tuple | None): The class record as (section, substituted_teacher), None to register the use only
+
+    Returns:
+        int: The id of the new record
+    """
+    with _writing(d_path) as conn:
+        record_id = conn.execute(SQL_REGISTER_WORKSHEET_USE, (sheet_id, class_name, teacher)).lastrowid
+        if class_record is not None:
+            conn.execute(SQL_INSERT_LAST_CLASS_RECORD, class_record)    # The class record refers to the record inserted just above
+    return record_id
+
+def registerWorksheetUses(d_path: str, rows: list[tuple]) -> None:
+    """
+    Register multiple uses of worksheets in the database within a single transaction
+
+    Args:
+        d_path (str): The path to the database
+        rows (list[tuple]): The uses to register, each as (sheet_id, use_date, class_name, teacher)
+
     Returns:
         None
     """
-    use_date = dt.now().strftime('%Y-%m-%d %H:%M:%S')
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("INSERT INTO records (sheet_id, use_date, class, teacher) VALUES (?, ?, ?, ?)", (sheet_id, use_date, class_name, teacher))
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        _insertRows(conn, SQL_INSERT_RECORDS, RECORD_ROW, rows)
 
 def registerClassRecord(d_path: str, record_id: int, section: int, substituted_teacher: str) -> None:
     """
@@ -294,12 +724,21 @@ def registerClassRecord(d_path: str, record_id: int, section: int, substituted_t
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("INSERT INTO class_records (record_id, section, substituted_teacher) VALUES (?, ?, ?)", (record_id, section, substituted_teacher))
-    c.close()
-    conn.commit()
-    conn.close()
+    registerClassRecords(d_path, [(record_id, section, substituted_teacher)])
+
+def registerClassRecords(d_path: str, rows: list[tuple]) -> None:
+    """
+    Register multiple class records in the database within a single transaction
+
+    Args:
+        d_path (str): The path to the database
+        rows (list[tuple]): The class records to register, each as (record_id, section, substituted_teacher)
+
+    Returns:
+        None
+    """
+    with _writing(d_path) as conn:
+        _insertRows(conn, SQL_INSERT_CLASS_RECORDS, CLASS_RECORD_ROW, rows)
 
 def getWorksheetPath(d_path: str, sheet_id: int) -> str:
     """
@@ -312,13 +751,33 @@ def getWorksheetPath(d_path: str, sheet_id: int) -> str:
     Returns:
         str: The path of the worksheet
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT file_path FROM worksheet_paths WHERE sheet_id=?", (sheet_id,))
-    file_path = c.fetchone()
-    conn.close()
+    return _getWorksheetPathCached(d_path, sheet_id, _worksheetCacheGeneration)
+
+@lru_cache(maxsize=256)
+def _getWorksheetPathCached(d_path: str, sheet_id: int, generation: int) -> str:
+    with _reading(d_path) as conn:
+        file_path = conn.execute(SQL_GET_WORKSHEET_PATH, (sheet_id,)).fetchone()
     return file_path[0]
 
+def getWorksheetIdAndPath(d_path: str, name: str) -> tuple[int, str]:
+    """
+    Get the id and the path of a worksheet by its name in one query
+
+    Args:
+        d_path (str): The path to the database
+        name (str): The name of the worksheet
+
+    Returns:
+        tuple[int, str] | None: The id and the path of the worksheet, None if there is no worksheet with the name
+    """
+    return _getWorksheetIdAndPathCached(d_path, name, _worksheetCacheGeneration)
+
+@lru_cache(maxsize=256)
+def _getWorksheetIdAndPathCached(d_path: str, name: str, generation: int) -> tuple[int, str] | None:
+    with _reading(d_path) as conn:
+        worksheet = conn.execute(SQL_GET_WORKSHEET_ID_AND_PATH, (name,)).fetchone()
+    return None if worksheet is None else tuple(worksheet)
+
 def latestRecords(d_path, amount = 15):
     """
     Get the latest records from the database, by default 15 records are returned
@@ -330,11 +789,8 @@ def latestRecords(d_path, amount = 15):
     Returns:
         list: A list with the latest records
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT r.teacher, r.class, w.name, r.use_date AS worksheet_name FROM records r INNER JOIN worksheets w ON r.sheet_id = w.sheet_id ORDER BY r.use_date DESC LIMIT ?", (amount,))
-    records = c.fetchall()
-    conn.close()
+    with _reading(d_path) as conn:
+        records = conn.execute(SQL_LATEST_RECORDS, (amount,)).fetchall()
     return records
 
 def latestUploads(d_path, amount = 15):
@@ -348,11 +804,8 @@ def latestUploads(d_path, amount = 15):
     Returns:
         list: A list with the latest uploads
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT w.name, w.subject, w.form, w.last_update FROM worksheets w ORDER BY w.last_update DESC LIMIT ?", (amount,))
-    worksheets = c.fetchall()
-    conn.close()
+    with _reading(d_path) as conn:
+        worksheets = conn.execute(SQL_LATEST_UPLOADS, (amount,)).fetchall()
     return worksheets
 
 def getWorksheetsCount(d_path):
@@ -365,11 +818,13 @@ def getWorksheetsCount(d_path):
     Returns:
         int: The amount of worksheets in the database
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT COUNT(*) FROM worksheets")
-    count = c.fetchone()
-    conn.close()
+    with _reading(d_path) as conn:
+        try:
+            count = conn.execute(SQL_COUNT_WORKSHEETS).fetchone()
+        except sqlite3.OperationalError:
+            count = None    # The meta table is added by the schema upgrade, which didn't succeed on this database yet
+        if count is None:
+            count = conn.execute(SQL_COUNT_WORKSHEET_ROWS).fetchone()
     return count[0]
 
 def getWorksheets(d_path: str) -> list:
@@ -382,12 +837,19 @@ def getWorksheets(d_path: str) -> list:
     Returns:
         list: A list with all worksheets
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT * FROM worksheets")
-    worksheets = c.fetchall()
-    conn.close()
-    return worksheets
+    return list(iterWorksheets(d_path))
+
+def iterWorksheets(d_path: str):
+    """
+    Iterate over all worksheets in the database without loading the whole table into memory
+
+    Args:
+        d_path (str): The path to the database
+
+    Returns:
+        Iterator[tuple]: The worksheets, one at a time
+    """
+    return _iterRows(d_path, SQL_GET_WORKSHEETS)
 
 def getRecords(d_path: str) -> list:
     """
@@ -399,12 +861,19 @@ def getRecords(d_path: str) -> list:
     Returns:
         list: A list with all records
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT * FROM records")
-    records = c.fetchall()
-    conn.close()
-    return records
+    return list(iterRecords(d_path))
+
+def iterRecords(d_path: str):
+    """
+    Iterate over all records in the database without loading the whole table into memory
+
+    Args:
+        d_path (str): The path to the database
+
+    Returns:
+        Iterator[tuple]: The records, one at a time
+    """
+    return _iterRows(d_path, SQL_GET_RECORDS)
 
 def getClassRecords(d_path: str) -> list:
     """
@@ -416,12 +885,19 @@ def getClassRecords(d_path: str) -> list:
     Returns:
         list: A list with all class records
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT * FROM class_records")
-    class_records = c.fetchall()
-    conn.close()
-    return class_records
+    return list(iterClassRecords(d_path))
+
+def iterClassRecords(d_path: str):
+    """
+    Iterate over all class records in the database without loading the whole table into memory
+
+    Args:
+        d_path (str): The path to the database
+
+    Returns:
+        Iterator[tuple]: The class records, one at a time
+    """
+    return _iterRows(d_path, SQL_GET_CLASS_RECORDS)
 
 def getRecordsByClass(d_path: str, class_name: str) -> list:
     """
@@ -434,11 +910,8 @@ def getRecordsByClass(d_path: str, class_name: str) -> list:
     Returns:
         list: A list with all records with the class name
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT * FROM records WHERE class=?", (class_name,))
-    records = c.fetchall()
-    conn.close()
+    with _reading(d_path) as conn:
+        records = conn.execute(SQL_GET_RECORDS_BY_CLASS, (class_name,)).fetchall()
     return records
 
 def getRecordsByTeacher(d_path: str, teacher: str) -> list:
@@ -452,11 +925,8 @@ def getRecordsByTeacher(d_path: str, teacher: str) -> list:
     Returns:
         list: A list with all records with the teacher name
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT * FROM records WHERE teacher=?", (teacher,))
-    records = c.fetchall()
-    conn.close()
+    with _reading(d_path) as conn:
+        records = conn.execute(SQL_GET_RECORDS_BY_TEACHER, (teacher,)).fetchall()
     return records
 
 def getWorksheetPaths(d_path: str) -> list:
@@ -469,12 +939,19 @@ def getWorksheetPaths(d_path: str) -> list:
     Returns:
         list: A list with all worksheet paths 
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT * FROM worksheet_paths")
-    worksheet_paths = c.fetchall()
-    conn.close()
-    return worksheet_paths
+    return list(iterWorksheetPaths(d_path))
+
+def iterWorksheetPaths(d_path: str):
+    """
+    Iterate over all worksheet paths in the database without loading the whole table into memory
+
+    Args:
+        d_path (str): The path to the database
+
+    Returns:
+        Iterator[tuple]: The worksheet paths, one at a time
+    """
+    return _iterRows(d_path, SQL_GET_WORKSHEET_PATHS)
 
 def getUsageDetails(d_path: str) -> list:
     """
@@ -488,11 +965,37 @@ def getUsageDetails(d_path: str) -> list:
     Returns:
         list: A list with all usage details
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("SELECT r.record_id, r.class, r.teacher, w.name, r.use_date, cr.section, cr.substituted_teacher FROM records r LEFT JOIN class_records cr ON r.record_id = cr.record_id INNER JOIN worksheets w ON r.sheet_id = w.sheet_id")
-    usage_details = c.fetchall()
-    conn.close()
+    return list(iterUsageDetails(d_path))
+
+def iterUsageDetails(d_path: str):
+    """
+    Iterate over the details of each usage without loading them all into memory, see getUsageDetails
+
+    Args:
+        d_path (str): The path to the database
+
+    Returns:
+        Iterator[tuple]: The usage details, one at a time
+    """
+    return _iterRows(d_path, SQL_GET_USAGE_DETAILS)
+
+def getUsageDetailsSince(d_path: str, since: str | None = None, limit: int = -1, offset: int = 0) -> list:
+    """
+    Get the details of the usages since a date, newest first, see getUsageDetails for the columns
+
+    The filter, order and paging are done by SQLite on the use date index, so only the requested rows are read
+
+    Args:
+        d_path (str): The path to the database
+        since (str | None): The earliest use date to include, in the '%Y-%m-%d %H:%M:%S' format or a prefix of it, None for all dates
+        limit (int): The amount of usages to be returned, -1 for no limit (default is -1)
+        offset (int): The amount of newest usages to skip (default is 0)
+
+    Returns:
+        list: A list with the usage details
+    """
+    with _reading(d_path) as conn:
+        usage_details = conn.execute(SQL_GET_USAGE_DETAILS_SINCE, (since or '', limit, offset)).fetchall()
     return usage_details
 
 def updateWorksheet(d_path: str, column: str, value: str, condition: str) -> None:
@@ -501,24 +1004,21 @@ def updateWorksheet(d_path: str, column: str, value: str, condition: str) -> Non
     
     Args:
         d_path (str): The path to the database
-        column (str): The column to be updated
+        column (str): The column to be updated, one of the keys of SQL_UPDATE_WORKSHEET (KeyError otherwise)
         value (str): The new value
         condition (str): The condition to be met
         
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    query = """UPDATE worksheets SET {} = ? WHERE sheet_id = ?""".format(column)
-    c.execute(query, (value, condition))
-    c.close()
-    conn.commit()
-    conn.close()
+    query = SQL_UPDATE_WORKSHEET[column]
+    with _writing(d_path) as conn:
+        conn.execute(query, (value, condition))
+    _clearWorksheetCaches()
 
 def resetRecordsTable(d_path: str) -> None:
     """
-    Reset the records table in the database
+    Reset the records table in the database, the class records that belong to the records are removed as well
     
     Args:
         d_path (str): The path to the database
@@ -526,12 +1026,9 @@ def resetRecordsTable(d_path: str) -> None:
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("DELETE FROM records")
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        conn.execute(SQL_CLEAR_CLASS_RECORDS)
+        conn.execute(SQL_CLEAR_RECORDS)
 
 def resetDatabaseToDefault(d_path: str) -> None:
     """
@@ -543,18 +1040,16 @@ def resetDatabaseToDefault(d_path: str) -> None:
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("DELETE FROM worksheets")
-    c.execute("DELETE FROM records")
-    c.execute("DELETE FROM worksheet_paths")
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        conn.execute(SQL_CLEAR_CLASS_RECORDS)
+        conn.execute(SQL_CLEAR_WORKSHEET_PATHS)
+        conn.execute(SQL_CLEAR_RECORDS)
+        conn.execute(SQL_CLEAR_WORKSHEETS)
+    _clearWorksheetCaches()
 
 def removeRecord(d_path: str, record_id: int) -> None:
     """
-    Remove a record from the database by its id
+    Remove a record from the database by its id, its class record is removed with it
     
     Args:
         d_path (str): The path to the database
@@ -563,16 +1058,12 @@ def removeRecord(d_path: str, record_id: int) -> None:
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("DELETE FROM records WHERE record_id=?", (record_id,))
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        conn.execute(SQL_REMOVE_RECORD, (record_id,))
 
 def removeWorksheet(d_path: str, sheet_id: int) -> None:
     """
-    Remove a worksheet from the database by its id
+    Remove a worksheet from the database by its id, its paths, records and class records are removed with it
     This method is not recommanded to use unless it's necessary
 
     Args:
@@ -582,12 +1073,9 @@ def removeWorksheet(d_path: str, sheet_id: int) -> None:
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("DELETE FROM worksheets WHERE sheet_id=?", (sheet_id,))
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        conn.execute(SQL_REMOVE_WORKSHEET, (sheet_id,))
+    _clearWorksheetCaches()
 
 def removeWorksheetPath(d_path: str, sheet_id: int) -> None:
     """
@@ -601,32 +1089,38 @@ def removeWorksheetPath(d_path: str, sheet_id: int) -> None:
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute("DELETE FROM worksheet_paths WHERE sheet_id=?", (sheet_id,))
-    c.close()
-    conn.commit()
-    conn.close()
+    with _writing(d_path) as conn:
+        conn.execute(SQL_REMOVE_WORKSHEET_PATH, (sheet_id,))
+    _clearWorksheetCaches()
 
-def runSQLCommand(d_path: str, command: str) -> None:
+def runSQLCommand(d_path: str, command: str, parameters: tuple = ()) -> None:
     """
-    Run a SQL command in the database
+    Run a SQL command in the database, the rows it returns are printed one per line
     
     Args:
         d_path (str): The path to the database
         command (str): The SQL command
+        parameters (tuple): The parameters of the command
     
     Returns:
         None
     """
-    conn = sqlite3.connect(d_path)
-    c = conn.cursor()
-    c.execute(command)
-    result = c.fetchall()
-    print(result)
-    c.close()
-    conn.commit()
-    conn.close()
+    with _getPool(d_path).writer() as conn:
+        # A command can leave a transaction open (BEGIN for example), it is committed as a connection of its own would have been,
+        # or rolled back if the command failed, so the writer never stays inside it
+        try:
+            cursor = conn.execute(command, parameters)
+            if cursor.description is not None:    # Only statements that return rows have a description
+                while rows := cursor.fetchmany(FETCH_SIZE):
+                    for row in rows:
+                        print(row)
+        except BaseException:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            raise
+        if conn.in_transaction:
+            conn.execute('COMMIT')
+    _clearWorksheetCaches()
 
 if __name__ == '__main__':
     createDatabase('data/database.db')
\ No newline at end of file
@@ -1,17 +1,25 @@
 from datetime import datetime
-import json
+import csv
+import orjson
 import sys
 import socket, threading
+import time
+from functools import lru_cache
+from collections import OrderedDict
 from src.protocol import REQUEST, ExecutorScope, ProtocolExecutor, ProtocolData, ProtocolHandler, RESPONSE, STATUS
-from src.helper import sendMessage, recvMessage
+from src.helper import sendMessage, recvMessage, sendFile, recvFile
 import database as db
-from src.networking import createUDPThread, createTCPThread
+from src.networking import createUDPThread, createTCPThread, createSelectorThread, tuneTCPSocket, findLocalIP
 import argparse
 
-import base64
 import traceback
 import os
+import tempfile
+from contextlib import suppress
 import logging, colorlog
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+import atexit
 
 from PySide6.QtWidgets import QApplication, QMainWindow, QTableWidgetItem, QTableWidget, QMessageBox, QDialog
 from PySide6.QtCore import QTimer, Qt
@@ -20,14 +28,18 @@ from PySide6.QtCore import QTimer, Qt
 from ui.management_ui import Ui_MainWindow
 from ui.entryRemoveWizard_ui import Ui_EntryRemoveWizard
 
-LOCAL_IP = socket.gethostbyname(socket.gethostname())
+LOCAL_IP = findLocalIP()
 PRODUCTION_UDP_PORT = 19864
 PRODUCTION_TCP_PORT = 19865
 DEVELOPMENT_UDP_PORT = 19866
 DEVELOPMENT_TCP_PORT = 19867
 SOCKETS = {'udp': PRODUCTION_UDP_PORT, 'tcp': PRODUCTION_TCP_PORT, 'socket_udp': None, 'socket_tcp': None}
 
-SERVER_VERSION = '2.0.0'
+SERVER_VERSION = '3.0.0'
+
+# Timestamp formats, the file one is used in the names of exported files
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+FILE_TIMESTAMP_FORMAT = '%Y-%m-%d %H-%M-%S'
 
 # Resources Path
 RESOURCES_PATH = 'res/'
@@ -51,29 +63,202 @@ fileHandler.setLevel(logging.INFO)
 
 formatter = colorlog.ColoredFormatter(
     "%(log_color)s%(asctime)s - %(levelname)s - %(message)s", 
-    datefmt="%Y-%m-%d %H:%M:%S", 
+    datefmt=TIMESTAMP_FORMAT, 
     log_colors={ 'DEBUG': 'cyan', 'INFO': 'green', 'WARNING': 'yellow', 'ERROR': 'red', 'CRITICAL': 'bold_red', }
 )
-fileFormatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+fileFormatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s', datefmt=TIMESTAMP_FORMAT)
 
 logHandler.setFormatter(formatter)
 fileHandler.setFormatter(fileFormatter)
 
-logger.addHandler(logHandler)
-logger.addHandler(fileHandler)
+# The handlers run on a listener thread, so writing the log never blocks the thread serving a request
+logQueue = SimpleQueue()
+logListener = QueueListener(logQueue, logHandler, fileHandler, respect_handler_level=True)
+logListener.start()
+atexit.register(logListener.stop)
+
+logger.addHandler(QueueHandler(logQueue))
 
 handler = ProtocolHandler()
 
-addressbook = {}
+# Seconds a selector worker waits on a client that stopped sending or reading in the middle of a request before dropping it
+CLIENT_TIMEOUT = 10
+
+# Host names of the clients by ip, the clients seen least recently are dropped once there are more than ADDRESSBOOK_SIZE
+ADDRESSBOOK_SIZE = 4096
+addressbook = OrderedDict()
+addressbookLock = threading.Lock()
+
+# Addresses whose host name could not be resolved, with the time of the lookup, they are looked up again after HOST_RETRY_SECONDS
+HOST_RETRY_SECONDS = 300
+unresolvedHosts = OrderedDict()
+unresolvedHostsLock = threading.Lock()
 
 stop = threading.Event()
 
 progRes = None
 
+# The names of the forms and subjects in the resources, in the order the clients refer to them by index
+resourceNames = {
+    'forms': (),
+    'subjects': (),
+}
+
+metadataLock = threading.Lock()
+recentRepliesLock = threading.Lock()
+
 database_metadata = {
     'count': db.getWorksheetsCount(DATABASE_PATH)   # Only update when there are changes on the database
 }
 
+def encodeReply(response: RESPONSE, mainMessage = None) -> bytes:
+    """
+    Build an encoded reply. A handler is created per reply, as a handler holds the message it prepares until it is serialized,
+    so sharing one between the threads serving the clients could mix up their replies.
+
+    Args:
+        response (RESPONSE): The response type of the reply.
+        mainMessage: The main message of the reply, an empty message if None.
+
+    Returns:
+        bytes: The encoded reply, ready for sendMessage.
+    """
+    return ProtocolHandler().prepMessage(response, mainMessage={} if mainMessage is None else mainMessage).serializeMessage().encode()
+
+# Encoded replies made of a response type and a status only, these never change
+STATUS_REPLIES = {(response, status): encodeReply(response, status) for response in RESPONSE for status in STATUS}
+
+# Encoded replies of the requests whose answer only changes when the resources or the database metadata change
+cachedReplies = {
+    'discovery': encodeReply(RESPONSE.OK, LOCAL_IP),
+    'testConnection': encodeReply(RESPONSE.OK),
+    'checkVersion': encodeReply(RESPONSE.OK, SERVER_VERSION),
+    'totalWorksheets': encodeReply(RESPONSE.OK, database_metadata['count']),
+}
+
+# Database writes the client does not wait for, as (function, args), run in order by the databaseWriter thread
+databaseWrites = SimpleQueue()
+
+# Cached replies built from the latest rows of the database, they are dropped whenever the records or worksheets change
+RECENT_REPLIES = ('recentUsage', 'recentUploaded')
+
+# Cached unused worksheets replies by class name, dropped together with the recent replies, at most UNUSED_REPLIES_SIZE classes are kept
+UNUSED_REPLIES_SIZE = 256
+unusedReplies = OrderedDict()
+
+# Bumped whenever the recent and unused replies are dropped. The replies are built outside recentRepliesLock,
+# and one is only cached if no change happened since its query started, so a reply built from old rows is never kept
+replyGeneration = 0
+
+def loadResources():
+    """
+    Load the resources file, index the form and subject names and cache the global data reply built from it.
+
+    Returns:
+        None
+    """
+    global progRes
+    with open(RESOURCES_PATH + 'data.json', 'rb') as file:
+        progRes = orjson.loads(file.read())
+    resourceNames['forms'] = tuple(sys.intern(form['name']) for form in progRes['forms'])
+    resourceNames['subjects'] = tuple(sys.intern(subject['name']) for subject in progRes['subjects'])
+    cachedReplies['globalData'] = encodeReply(RESPONSE.OK, orjson.dumps(progRes).decode())
+
+def updateDatabaseMetadata(increment: int = None):
+    """
+    Update the database metadata and the cached replies built from the database, this must be called after the worksheets are changed.
+
+    Args:
+        increment (int): The known change of the worksheet count, when given the database is not queried.
+
+    Returns:
+        None
+    """
+    with metadataLock:
+        if increment is None:
+            database_metadata['count'] = db.getWorksheetsCount(DATABASE_PATH)
+        else:
+            database_metadata['count'] += increment
+        cachedReplies['totalWorksheets'] = encodeReply(RESPONSE.OK, database_metadata['count'])
+    invalidateRecentReplies()
+
+def recentReply(key: str, query) -> bytes:
+    """
+    Get the encoded reply of a recent usage or recent uploaded request, the reply is only built when it is not cached.
+
+    Args:
+        key (str): The key of the reply in RECENT_REPLIES.
+        query (function): The database function that returns the rows of the reply.
+
+    Returns:
+        bytes: The encoded reply.
+    """
+    with recentRepliesLock:
+        reply = cachedReplies.get(key)
+        generation = replyGeneration
+    if reply is None:
+        reply = encodeReply(RESPONSE.OK, orjson.dumps(query(DATABASE_PATH)).decode())
+        with recentRepliesLock:
+            if generation == replyGeneration:
+                cachedReplies[key] = reply
+    return reply
+
+def unusedReply(className: str) -> bytes:
+    """
+    Get the encoded reply of an unused worksheets request, the reply is only built when it is not cached for the class.
+
+    Args:
+        className (str): The class name of the request.
+
+    Returns:
+        bytes: The encoded reply.
+    """
+    with recentRepliesLock:
+        reply = unusedReplies.get(className)
+        generation = replyGeneration
+        if reply is not None:
+            unusedReplies.move_to_end(className)
+            return reply
+    reply = encodeReply(RESPONSE.OK, orjson.dumps(db.findUnusedWorksheetsMatchClass(DATABASE_PATH, className)).decode())
+    with recentRepliesLock:
+        if generation == replyGeneration:
+            unusedReplies[className] = reply
+            if len(unusedReplies) > UNUSED_REPLIES_SIZE:
+                unusedReplies.popitem(last=False)
+    return reply
+
+def invalidateRecentReplies():
+    """
+    Drop the cached recent usage, recent uploaded and unused worksheets replies, this must be called after the records or worksheets are changed.
+
+    Returns:
+        None
+    """
+    global replyGeneration
+    with recentRepliesLock:
+        replyGeneration += 1
+        for key in RECENT_REPLIES:
+            cachedReplies.pop(key, None)
+        unusedReplies.clear()
+
+def sendDiscoveryReply(_, addr: tuple):
+    """
+    Send the server ip to an upcoming potential client.
+
+    Args:
+        addr (tuple): The address of the client.
+
+    Returns:
+        None
+    """
+    logger.info('Client found: %s', addr)
+    logger.info('Sending server ip: %s to %s and wait for TCP connection', LOCAL_IP, addr)
+    SOCKETS['socket_udp'].sendto(cachedReplies['discovery'], addr)
+
+# The handler of the discovery broadcasts, registered once and shared by all of them
+discoveryExecutor = ProtocolExecutor()
+discoveryExecutor.addMessageHandler(sendDiscoveryReply, REQUEST.POST, 'elerp_client', ExecutorScope.COMMAND)
+
 def udpService(data: ProtocolData, addr: tuple):
     """
     The new UDP service function focus on handling the message from the client,
@@ -81,38 +266,93 @@ def udpService(data: ProtocolData, addr: tuple):
 
     Args:
         data (ProtocolData): The data received from the client.
-        socket (socket): The socket object to send the message back to the client.
+        addr (tuple): The address of the client.
         The args have to match the signature of the function in networking.py
     Returns:
         None
     """
-    def sendToClient(_):
-        """
-        Send a message to upcoming potential client.
+    try:
+        discoveryExecutor.executeMessage(data, addr=addr)
+    except ValueError:
+        # The incoming message is send by an invalid client that uses the same protocol, but looking for other server
+        logger.warning('Invalid client found: %s with message %s', addr, data)
+        SOCKETS['socket_udp'].sendto(STATUS_REPLIES[RESPONSE.ERROR, STATUS.INVALID_REQUEST], addr)
 
-        Returns:
-            None
-        """
-        message = handler.prepMessage(RESPONSE.OK, mainMessage=LOCAL_IP).serializeMessage()
-        logger.info(f'Client found: {addr}')
-        logger.info(f'Sending server ip: {LOCAL_IP} to {addr} and wait for TCP connection')
-        SOCKETS['socket_udp'].sendto(message.encode(), addr)
+@lru_cache(maxsize=1024)
+def lookupHost(ip: str) -> str:
+    """
+    Look up the host name of an address, only the names found are cached as a failed lookup raises.
+
+    Args:
+        ip (str): The ip address of the client.
+
+    Returns:
+        str: The host name of the client.
+    """
+    return socket.gethostbyaddr(ip)[0]
 
-    executor = ProtocolExecutor(data)
-    executor.addMessageHandler(sendToClient, REQUEST.POST, 'elerp_client', ExecutorScope.COMMAND)
+def resolveHost(ip: str) -> str:
+    """
+    Resolve the host name of a client, the names found are cached so each address is only looked up once,
+    an address that can't be resolved is only looked up again after HOST_RETRY_SECONDS.
+
+    Args:
+        ip (str): The ip address of the client.
+
+    Returns:
+        str: The host name of the client, or the ip address if it can't be resolved.
+    """
+    with unresolvedHostsLock:
+        failed = unresolvedHosts.get(ip)
+    if failed is not None and time.monotonic() - failed < HOST_RETRY_SECONDS:
+        return ip
     try:
-        executor.executeHandlers()
-    except ValueError as e:
-        e.with_traceback()
-        # The incoming message is send by an invalid client that uses the same protocol, but looking for other server
-        message = handler.prepMessage(RESPONSE.ERROR, mainMessage=STATUS.INVALID_REQUEST).serializeMessage()
-        logger.warning(f'Invalid client found: {addr} with message {data}')
-        SOCKETS['socket_udp'].sendto(message.encode(), addr)
+        return lookupHost(ip)
+    except OSError:
+        with unresolvedHostsLock:
+            unresolvedHosts.pop(ip, None)
+            unresolvedHosts[ip] = time.monotonic()
+            while len(unresolvedHosts) > ADDRESSBOOK_SIZE:
+                unresolvedHosts.popitem(last=False)
+        return ip
+
+def touchClient(ip: str):
+    """
+    Mark a client as the most recently seen one in the addressbook, its host name is resolved when it is not known yet.
+
+    Args:
+        ip (str): The ip address of the client.
+
+    Returns:
+        None
+    """
+    with addressbookLock:
+        if addressbook.get(ip, ip) != ip:
+            addressbook.move_to_end(ip)
+            return
+    name = resolveHost(ip)  # Resolved outside the lock, as the lookup can take a while
+    with addressbookLock:
+        addressbook[ip] = name
+        while len(addressbook) > ADDRESSBOOK_SIZE:
+            addressbook.popitem(last=False)
+
+def clientName(ip: str) -> str:
+    """
+    Get the host name of a client for logging, the ip address is returned if the client is not in the addressbook.
+
+    Args:
+        ip (str): The ip address of the client.
+
+    Returns:
+        str: The host name of the client.
+    """
+    return addressbook.get(ip, ip)
 
 def tcpService(conn: socket.socket, addr: tuple):
     """
     The new TCP service function focus on handling the message from the client,
     while the loop is abstracted away in networking.py.
+    The connection is handed to the selector thread, which serves its requests once they arrive.
     
     Args:
         conn (socket): The connection object.
@@ -121,33 +361,34 @@ def tcpService(conn: socket.socket, addr: tuple):
     Returns:
         None
     """
-    logger.info(f'Connected by {addr} via TCP')
-    clientService = threading.Thread(target=clientHandler, args=(conn, addr, stop))
-    clientService.daemon = True
-    clientService.start()
+    logger.info('Connected by %s via TCP', addr)
+    tuneTCPSocket(conn)
+    conn.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)    # Idle clients that vanished are dropped by the system
+    conn.settimeout(CLIENT_TIMEOUT)
+    watchClient(conn, addr[0])
 
-def handelUpload(request:dict) -> str:
+def handelUpload(request:dict, conn) -> tuple[bytes, bool]:
     """
     Handle the upload request from the client.
     The function will check if all infoormation is provided and then save the file to the server.
+    The file itself follows the request as raw bytes (see sendFile), they are written to disk as they arrive.
     Afterward it will return a message indicating the result of the upload action.
 
     request (dict): The upload request containing the following keys:
-        - fileData (str): Base64 encoded file data.
         - form (str): The form identifier.
         - subject (str): The subject identifier.
         - name (str): The name of the file.
         - description (str): The description of the file.
         - creationDate (str): The creation date of the file.
-    str: Serialized message indicating the result of the upload action.
+    bytes: Encoded message indicating the result of the upload action.
 
     Args:
         request (dict): The upload request.
+        conn (socket): The connection object, the file is received from it.
 
     Returns:
-        result: The result of the upload action
+        tuple: The encoded result of the upload action and whether the worksheet was stored
     """
-    fileData = request['fileData']
     form = request['form']
     subject = request['subject']
     name = request['name']
@@ -155,73 +396,121 @@ def handelUpload(request:dict) -> str:
     creationDate = request['creationDate']
     
     # Check if the form, subject, name and data are provided
-    if form is None or subject is None or name is None or fileData is None:
-        return handler.prepMessage(RESPONSE.ERROR, mainMessage=STATUS.EMPTY_PARAMETER).serializeMessage()
+    if form is None or subject is None or name is None:
+        recvFile(conn)    # The file still has to be read off the connection
+        return STATUS_REPLIES[RESPONSE.ERROR, STATUS.EMPTY_PARAMETER], False
     
-    form = progRes['forms'][form]   # Get the form from the resources
-    subject = progRes['subjects'][subject]  # Get the subject from the resources
-
-
-    # Check if the form and subject are valid
-    if form is None or subject is None:
-        return handler.prepMessage(RESPONSE.ERROR, mainMessage=STATUS.INVALID_PARAMETER).serializeMessage()
-
-    #try to convert the data back to file
+    # Get the form and subject names from the resources
+    try:
+        form = resourceNames['forms'][form]
+        subject = resourceNames['subjects'][subject]
+    except (IndexError, TypeError):
+        form = subject = None
+
+    # Check if the form and subject are valid, and the name is a plain file name that stays inside WORKSHEET_PATH
+    if form is None or subject is None or not name or os.path.basename(name) != name:
+        recvFile(conn)
+        return STATUS_REPLIES[RESPONSE.ERROR, STATUS.INVALID_PARAMETER], False
+
+    # The file is received into a temporary file next to it and only replaces the worksheet once it is complete,
+    # so a broken upload never leaves a truncated worksheet behind. WORKSHEET_PATH is created at startup
+    filePath = WORKSHEET_PATH + name
     try:
-        os.makedirs(WORKSHEET_PATH, exist_ok=True)
-        with open(os.path.join(WORKSHEET_PATH, name), 'wb') as file:
-            file.write(base64.b64decode(fileData.encode()))
-            file.close()
-    except:
+        fd, tempPath = tempfile.mkstemp(suffix='.part', dir=WORKSHEET_PATH)
+    except OSError:
         traceback.print_exc()
-        return handler.prepMessage(RESPONSE.ERROR, mainMessage=STATUS.UPLOAD_FAILED).serializeMessage()
+        recvFile(conn)
+        return STATUS_REPLIES[RESPONSE.ERROR, STATUS.UPLOAD_FAILED], False
+    try:
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                recvFile(conn, file)
+            os.replace(tempPath, filePath)
+        except BaseException:
+            with suppress(OSError):
+                os.unlink(tempPath)
+            raise
+    except (ConnectionError, socket.timeout):
+        raise   # The connection is out of sync, clientHandler drops it
+    except OSError:
+        traceback.print_exc()
+        return STATUS_REPLIES[RESPONSE.ERROR, STATUS.UPLOAD_FAILED], False
 
-    db.insertWorksheetAndPath(DATABASE_PATH, name, description, creationDate, subject['name'], form['name'], os.path.join(WORKSHEET_PATH, name))
-    return handler.prepMessage(RESPONSE.OK, mainMessage=STATUS.SUCCESS).serializeMessage()
+    db.insertWorksheetAndPath(DATABASE_PATH, name, description, creationDate, subject, form, filePath)
+    return STATUS_REPLIES[RESPONSE.OK, STATUS.SUCCESS], True
 
 def getTestHandler(_, conn, ip):
-    logger.info(f'Test request received from {addressbook[ip]}')
-    reply = handler.prepMessage(RESPONSE.OK).serializeMessage()
-    sendMessage(conn, reply.encode())
+    logger.info('Test request received from %s', clientName(ip))
+    sendMessage(conn, cachedReplies['testConnection'])
 
 def getVersionHandler(_, conn, ip):
-    logger.info(f'Version request received from {addressbook[ip]}')
-    reply = handler.prepMessage(RESPONSE.OK, mainMessage=SERVER_VERSION).serializeMessage()
-    sendMessage(conn, reply.encode())
+    logger.info('Version request received from %s', clientName(ip))
+    sendMessage(conn, cachedReplies['checkVersion'])
     
 def getGlobalDataHandler(_, conn, ip):
-    logger.info(f'Global data request received from {addressbook[ip]}')
-    reply = handler.prepMessage(RESPONSE.OK, mainMessage=json.dumps(progRes)).serializeMessage()
-    sendMessage(conn, reply.encode())
+    logger.info('Global data request received from %s', clientName(ip))
+    sendMessage(conn, cachedReplies['globalData'])
 
 def getRecentUsageHandler(_, conn, ip):
-    logger.info(f'Recent usage request received from {addressbook[ip]}')
-    reply = handler.prepMessage(RESPONSE.OK, mainMessage=json.dumps(db.latestRecords(DATABASE_PATH))).serializeMessage()
-    sendMessage(conn, reply.encode())
+    logger.info('Recent usage request received from %s', clientName(ip))
+    sendMessage(conn, recentReply('recentUsage', db.latestRecords))
 
 def getRecentUploadedHandler(_, conn, ip):
-    logger.info(f'Recent uploaded request received from {addressbook[ip]}')
-    reply = handler.prepMessage(RESPONSE.OK, mainMessage=json.dumps(db.latestUploads(DATABASE_PATH))).serializeMessage()
-    sendMessage(conn, reply.encode())
+    logger.info('Recent uploaded request received from %s', clientName(ip))
+    sendMessage(conn, recentReply('recentUploaded', db.latestUploads))
 
 def getUnusedWorksheets(message, conn, ip):
-    logger.info(f'Unused worksheets request received from {addressbook[ip]}')
-    reply = handler.prepMessage(RESPONSE.OK, mainMessage=json.dumps(db.findUnusedWorksheetsMatchClass(DATABASE_PATH, message['class']))).serializeMessage()
-    sendMessage(conn, reply.encode())
+    logger.info('Unused worksheets request received from %s', clientName(ip))
+    sendMessage(conn, unusedReply(message['class']))
 
 def postUploadWorksheet(message, conn, ip):
-    logger.info(f'Upload request received from {addressbook[ip]}')
-    reply = handelUpload(message)
-    sendMessage(conn, reply.encode())
+    logger.info('Upload request received from %s', clientName(ip))
+    reply, stored = handelUpload(message, conn)
+    sendMessage(conn, reply)
+
+    # A stored upload adds exactly one worksheet, no need to count them again
+    if stored:
+        updateDatabaseMetadata(1)
+
+def recordUsage(sheetId: int, className: str, teacher: str, classRecord: tuple | None):
+    """
+    Register the use of a worksheet together with its class record and drop the recent replies that show it.
+
+    Args:
+        sheetId (int): The id of the worksheet.
+        className (str): The class name.
+        teacher (str): The teacher name.
+        classRecord (tuple | None): The class record as (section, substituted_teacher), None if the client did not provide it.
+
+    Returns:
+        None
+    """
+    db.registerWorksheetUseWithClassRecord(DATABASE_PATH, sheetId, className, teacher, classRecord)
+    invalidateRecentReplies()
 
-    # Update the database metadata to reflect the changes
-    database_metadata['count'] = db.getWorksheetsCount(DATABASE_PATH)
+def databaseWriter():
+    """
+    Run the queued database writes one after another, until the None write queued at shutdown.
+    A failed write is logged and does not stop the writes after it.
+
+    Returns:
+        None
+    """
+    while True:
+        write, args = databaseWrites.get()
+        if write is None:
+            break
+        try:
+            write(*args)
+        except Exception:
+            logger.exception('Queued database write %s failed', write.__name__)
 
 def postRegisterUsage(message, conn, ip):
     """
     Handle the register usage request from the client.
-    Worksheet and class record will be registered in the database seperately as the old version did not track the class record.
-    And logically, worksheet and class record should be seperated anyway.
+    The reply is followed by the worksheet file (see sendFile), so it is never held in memory as a whole.
+    Worksheet and class record are kept in seperate tables as the old version did not track the class record,
+    but both rows are written in the same transaction, queued for the database writer thread.
     
     Args:
         message (dict): The message containing the following
@@ -236,72 +525,109 @@ def postRegisterUsage(message, conn, ip):
     Returns:
         None
     """
-    logger.info(f'Register usage request received from {addressbook[ip]}')
-    w_id = db.getWorksheetId(DATABASE_PATH, message['worksheet'])
-    path = db.getWorksheetPath(DATABASE_PATH, w_id)
-    with open(path, 'rb') as file:
-        fileData = file.read()
-        file.close()
-    reply = handler.prepMessage(RESPONSE.OK, mainMessage=fileData).serializeMessage()
-    sendMessage(conn, reply.encode())
-    logger.info(f'Sending worksheet to {addressbook[ip]}')
-    db.registerWorksheetUse(DATABASE_PATH, w_id, message['class'], message['teacher'])  # Register the worksheet is used on class X by teacher Y
-    
+    logger.info('Register usage request received from %s', clientName(ip))
+    worksheet = db.getWorksheetIdAndPath(DATABASE_PATH, message['worksheet'])
+    if worksheet is None:
+        logger.warning('Unknown worksheet %s requested by %s', message['worksheet'], clientName(ip))
+        sendMessage(conn, STATUS_REPLIES[RESPONSE.ERROR, STATUS.INVALID_PARAMETER])
+        return
+    w_id, path = worksheet
+    try:
+        file = open(path, 'rb')
+    except OSError:
+        traceback.print_exc()
+        sendMessage(conn, STATUS_REPLIES[RESPONSE.ERROR, STATUS.INVALID_PARAMETER])
+        return
+    with file:
+        logger.info('Sending worksheet to %s', clientName(ip))
+        sendFile(conn, file, STATUS_REPLIES[RESPONSE.OK, STATUS.SUCCESS])    # The reply and the file size go out in one send
     # In order to deal with possible old client that does not provide class information, a try catch is used here.
     try:
-        r_id = db.getLatestRecordId(DATABASE_PATH)
-        db.registerClassRecord(DATABASE_PATH, r_id, message['section'], message['subTeacher'])  # Register the class record
+        classRecord = (message['section'], message['subTeacher'])
     except KeyError as ke:
-        logger.warning(f'Class record not provided: {ke}, client info: {addressbook[ip]}, time {datetime.now()}')
+        classRecord = None
+        logger.warning('Class record not provided: %s, client info: %s, time %s', ke, clientName(ip), datetime.now())
+    # Register the worksheet is used on class X by teacher Y, the write is left to the database writer so the connection is free at once
+    databaseWrites.put((recordUsage, (w_id, message['class'], message['teacher'], classRecord)))
 
 def getTotalWorksheets(_, conn, ip):
-    logger.info(f'Total worksheets request received from {addressbook[ip]}')
-    reply = handler.prepMessage(RESPONSE.OK, mainMessage=database_metadata['count']).serializeMessage()
-    sendMessage(conn, reply.encode())
-
-def clientHandler(conn, addr, stop: threading.Event):
+    logger.info('Total worksheets request received from %s', clientName(ip))
+    sendMessage(conn, cachedReplies['totalWorksheets'])
+
+# The handlers of the client requests, registered once and shared by all connections, clientHandler passes the connection and ip to them
+clientExecutor = ProtocolExecutor()
+clientExecutor.addMessageHandler(getTestHandler, requestCommand='testConnection')
+clientExecutor.addMessageHandler(getVersionHandler, requestCommand='checkVersion')
+clientExecutor.addMessageHandler(getGlobalDataHandler, requestCommand='globalData')
+clientExecutor.addMessageHandler(getRecentUsageHandler, requestCommand='recentUsage')
+clientExecutor.addMessageHandler(getRecentUploadedHandler, requestCommand='recentUploaded')
+clientExecutor.addMessageHandler(getUnusedWorksheets, requestCommand='unusedWorksheets', scope=ExecutorScope.MESSAGE)
+clientExecutor.addMessageHandler(postUploadWorksheet, requestType=REQUEST.POST, requestCommand='uploadWorksheet', scope=ExecutorScope.MESSAGE)
+clientExecutor.addMessageHandler(postRegisterUsage, requestType=REQUEST.POST, requestCommand='registerUsage', scope=ExecutorScope.MESSAGE)
+clientExecutor.addMessageHandler(getTotalWorksheets, requestCommand='totalWorksheets')
+
+def clientHandler(conn, ip: str) -> bool:
     """
-    Handle the client connection. The function will keep listening for messages from the client.
-    and send replies back to the client. The function will stop when the client disconnects.
+    Handle one request of a client connection, this runs on a worker thread of the selector once the connection is readable.
+    The reply is sent back to the client by the handler of the request.
 
     Args:
         conn: The connection object.
-        addr: The address of the client.
+        ip (str): The ip address of the client.
 
     Returns:
-        None
+        bool: True if the connection stays open, False if the client disconnected.
     """
-    executor = ProtocolExecutor()
-
-    # The GET requests
-    executor.addMessageHandler(lambda _: getTestHandler(_, conn, ip), requestCommand='testConnection')
-    executor.addMessageHandler(lambda _: getVersionHandler(_, conn, ip), requestCommand='checkVersion')
-    executor.addMessageHandler(lambda _: getGlobalDataHandler(_, conn, ip), requestCommand='globalData')
-    executor.addMessageHandler(lambda _: getRecentUsageHandler(_, conn, ip), requestCommand='recentUsage')
-    executor.addMessageHandler(lambda _: getRecentUploadedHandler(_, conn, ip), requestCommand='recentUploaded')
-    executor.addMessageHandler(lambda message: getUnusedWorksheets(message, conn, ip), requestCommand='unusedWorksheets', scope=ExecutorScope.MESSAGE)
-    executor.addMessageHandler(lambda message: postUploadWorksheet(message, conn, ip), requestType=REQUEST.POST, requestCommand='uploadWorksheet', scope=ExecutorScope.MESSAGE)
-    executor.addMessageHandler(lambda message: postRegisterUsage(message, conn, ip), requestType=REQUEST.POST, requestCommand='registerUsage', scope=ExecutorScope.MESSAGE)
-    executor.addMessageHandler(lambda _: getTotalWorksheets(_, conn, ip), requestCommand='totalWorksheets')
-    while not stop.is_set():
-        try:
-            data = recvMessage(conn) # Receive the message from the client
-            if not data:
-                break
+    touchClient(ip)
+    try:
+        data = recvMessage(conn) # Receive the message from the client
+        if not data:
+            return False
+
+        clientExecutor.executeMessage(handler.deserializeMessageAsProtocolData(data), conn=conn, ip=ip)
+    except ConnectionResetError:
+        logger.info('Closing connection with %s', clientName(ip))
+        return False
+    except ConnectionError as e:
+        logger.warning('Closing connection with %s: %s', clientName(ip), e)
+        return False
+    except socket.timeout:
+        logger.warning('Closing connection with %s, no data for %s seconds', clientName(ip), CLIENT_TIMEOUT)
+        return False
+    return True
+
+def populateTable(table: QTableWidget, data, non_editable_columns: set = frozenset()):
+    """
+    Fill a table with rows of data, replacing its current rows.
+    Repaints, signals and sorting are suspended while the items are filled in, so the table only updates once at the end.
 
-            ip = addr[0]
-            addressbook[ip] = socket.gethostbyaddr(ip)[0] if socket.gethostbyaddr(ip)[0] not in addressbook else addressbook[ip] # Add the client to the addressbook
+    Args:
+        table (QTableWidget): The table to fill.
+        data (list): The rows to show.
+        non_editable_columns (set): The indexes of the columns that can't be edited.
 
-            decoded = handler.deserializeMessageAsProtocolData(data.decode())
-            executor.setMessage(decoded)
-            executor.executeHandlers()
+    Returns:
+        None
+    """
+    readOnlyFlags = QTableWidgetItem().flags() & ~Qt.ItemIsEditable
+    table.setUpdatesEnabled(False)
+    wasBlocked = table.blockSignals(True)
+    wasSorting = table.isSortingEnabled()
+    table.setSortingEnabled(False)
+    try:
+        table.setRowCount(len(data))
+        for i, row in enumerate(data):
+            for j, item in enumerate(row):
+                cell = QTableWidgetItem(str(item))
+                if j in non_editable_columns:
+                    cell.setFlags(readOnlyFlags)
+                table.setItem(i, j, cell)
+    finally:
+        table.setSortingEnabled(wasSorting)
+        table.blockSignals(wasBlocked)
+        table.setUpdatesEnabled(True)
+    table.resizeColumnsToContents()
 
-        except ConnectionResetError:
-            logger.info(f'Closing connection with {addressbook[ip]}')
-            conn.close()
-            break
-    conn.close()
-        
 class EditHistory:
     def __init__(self, table, row, column, oldValue, newValue):
         self.table = table
@@ -377,6 +703,7 @@ class ManagementUI(QMainWindow):
         for edit in self.editHistories:
             if edit.table == 'worksheet':
                 db.updateWorksheet(DATABASE_PATH, self.columnName(edit.table, edit.column), edit.newValue, self.allWorksheets[edit.row][0])
+        invalidateRecentReplies()
         self.setTempMessage('Changes saved')
         self.editHistories.clear()  # Clear the edit histories
 
@@ -407,19 +734,10 @@ class ManagementUI(QMainWindow):
         self.allRecords = db.getRecords(DATABASE_PATH)
         self.allClassRecords = db.getClassRecords(DATABASE_PATH)
 
-        def populateTable(table: QTableWidget, data, non_editable_columns: list):
-            table.setRowCount(len(data))
-            for i, row in enumerate(data):
-                for j, item in enumerate(row):
-                    table.setItem(i, j, QTableWidgetItem(str(item)))
-                    if j in non_editable_columns:
-                        table.item(i, j).setFlags(table.item(i, j).flags() & ~Qt.ItemIsEditable)
-            table.resizeColumnsToContents()
-
-        populateTable(self.ui.worksheetTable, self.allWorksheets, [0, 1, 3, 4])
-        populateTable(self.ui.recordTable, self.allRecords, [0, 1, 2, 3, 4])
-        populateTable(self.ui.pathTable, self.allWorksheetPaths, [0, 1, 2])
-        populateTable(self.ui.classRecordTable, self.allClassRecords, [0, 1, 2, 3])
+        populateTable(self.ui.worksheetTable, self.allWorksheets, {0, 1, 3, 4})
+        populateTable(self.ui.recordTable, self.allRecords, {0, 1, 2, 3, 4})
+        populateTable(self.ui.pathTable, self.allWorksheetPaths, {0, 1, 2})
+        populateTable(self.ui.classRecordTable, self.allClassRecords, {0, 1, 2, 3})
 
         self.editHistories.clear()  # Clear the edit histories, as the tables are refreshed
         self.setTempMessage('Tables refreshed')
@@ -429,12 +747,8 @@ class ManagementUI(QMainWindow):
         Save the master data to the resources file.
         """
         logger.info('Saving master data')
-        data = db.getUsageDetails(DATABASE_PATH)
-        currentTime = datetime.now().strftime('%Y-%m-%d %H-%M-%S')
-        with open(f'{currentTime}_masterData.csv', 'w', encoding='utf-8') as file:
-            file.write('Record ID, Class, Teacher, Worksheet, Use Date, Section, Substituted Teacher\n')
-            for record in data:
-                file.write(','.join(map(str, record)) + '\n')
+        currentTime = datetime.now().strftime(FILE_TIMESTAMP_FORMAT)
+        writeCSV(f'{currentTime}_masterData.csv', ['Record ID', 'Class', 'Teacher', 'Worksheet', 'Use Date', 'Section', 'Substituted Teacher'], db.iterUsageDetails(DATABASE_PATH))
         self.setTempMessage('Master data saved')
 
 
@@ -475,13 +789,9 @@ class EntryRemoveWizard(QDialog):
             return
         
         # Fill the table with database's data
-        self.ui.tableWidget.setRowCount(len(data))
         self.ui.tableWidget.setColumnCount(len(data[0]))
         self.ui.tableWidget.setHorizontalHeaderLabels(['ID', 'Name', 'Description', 'Upload Date', 'Last Update Date', 'Subject', 'Form'] if table == 'Worksheet' else ['ID', 'WorksheetID', 'Use Date', 'Class', 'Teacher'])
-        for i, row in enumerate(data):
-            for j, item in enumerate(row):
-                self.ui.tableWidget.setItem(i, j, QTableWidgetItem(str(item)))
-        self.ui.tableWidget.resizeColumnsToContents()
+        populateTable(self.ui.tableWidget, data)
 
     def removeEntry(self):
         """
@@ -492,14 +802,32 @@ class EntryRemoveWizard(QDialog):
         row = self.ui.rowCombox.currentText()
 
         if table == 'Worksheet':
-            db.removeWorksheet(DATABASE_PATH, row)
-            db.removeWorksheetPath(DATABASE_PATH, row)
+            db.removeWorksheet(DATABASE_PATH, row)    # The paths and records of the worksheet are removed with it
         elif table == 'Record':
             db.removeRecord(DATABASE_PATH, row)
+        updateDatabaseMetadata()
 
         self.accept()
 
 
+def writeCSV(fileName: str, header: list, rows):
+    """
+    Write rows to a csv file, the rows are written as they are read so the whole table is never held in memory.
+    Fields containing commas, quotes or line breaks are quoted by the csv writer.
+
+    Args:
+        fileName (str): The name of the csv file.
+        header (list): The column names.
+        rows (iterable): The rows to write, usually one of the iter functions of the database.
+
+    Returns:
+        None
+    """
+    with open(fileName, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
 def exportToCSV():
     """
     Export the database to a csv file.
@@ -508,22 +836,10 @@ def exportToCSV():
     Returns:
         None
     """
-    currentTime = datetime.now().strftime('%Y-%m-%d %H-%M-%S')
-    fileNames = [f'{currentTime}_worksheets.csv', f'{currentTime}_records.csv', f'{currentTime}_paths.csv']
-    with open(fileNames[0], 'w', encoding='utf-8') as file:
-        file.write('Worksheet ID, Name, Description, Upload Date, Last Update Date, Subject, Form\n')
-        for worksheet in db.getWorksheets(DATABASE_PATH):
-            file.write(','.join(map(str, worksheet)) + '\n')
-
-    with open(fileNames[1], 'w', encoding='utf-8') as file:
-        file.write('Record ID, Worksheet ID, Use Date, Class, Teacher\n')
-        for record in db.getRecords(DATABASE_PATH):
-            file.write(','.join(map(str, record)) + '\n')
-
-    with open(fileNames[2], 'w', encoding='utf-8') as file:
-        file.write('Path ID, Worksheet ID, File Path\n')
-        for path in db.getWorksheetPaths(DATABASE_PATH):
-            file.write(','.join(map(str, path)) + '\n')
+    currentTime = datetime.now().strftime(FILE_TIMESTAMP_FORMAT)
+    writeCSV(f'{currentTime}_worksheets.csv', ['Worksheet ID', 'Name', 'Description', 'Upload Date', 'Last Update Date', 'Subject', 'Form'], db.iterWorksheets(DATABASE_PATH))
+    writeCSV(f'{currentTime}_records.csv', ['Record ID', 'Worksheet ID', 'Use Date', 'Class', 'Teacher'], db.iterRecords(DATABASE_PATH))
+    writeCSV(f'{currentTime}_paths.csv', ['Path ID', 'Worksheet ID', 'File Path'], db.iterWorksheetPaths(DATABASE_PATH))
 
 def managementGUI():
     """
@@ -548,6 +864,60 @@ def initialize_sockets(LOCAL_IP, SOCKETS):
     SOCKETS['socket_tcp'] = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     SOCKETS['socket_tcp'].bind((LOCAL_IP, SOCKETS['tcp']))
 
+def quitServer():
+    stop.set()
+    print('Stopping server... Please wait')
+
+def resetDatabase():
+    db.resetDatabaseToDefault(DATABASE_PATH)
+    updateDatabaseMetadata()
+
+def resetRecords():
+    db.resetRecordsTable(DATABASE_PATH)
+    invalidateRecentReplies()
+
+def openManagementGUI():
+    print('Working in progress')
+    managementGUI()
+
+def runSQL():
+    try:
+        db.runSQLCommand(DATABASE_PATH, input('Enter SQL command: '))
+        updateDatabaseMetadata()
+    except Exception as e:
+        print(e)
+
+CONSOLE_MENU = '''
+ELERP Server management console
+quit/exit --- Quit
+list --- List all clients
+message --- Show message
+reset --- Reset database
+r_record --- Reset records
+version --- Show server version
+gui --- Database management tools
+csv --- Export database to csv
+sql --- Run SQL command
+help --- Show this menu'''
+
+def printConsoleMenu():
+    print(CONSOLE_MENU)
+
+# The commands of the management console, unknown commands are ignored
+CONSOLE_COMMANDS = {
+    'help': printConsoleMenu,
+    'quit': quitServer,
+    'exit': quitServer,
+    'list': lambda: print(dict(addressbook)),
+    'message': lambda: print(progRes),
+    'reset': resetDatabase,
+    'r_record': resetRecords,
+    'version': lambda: print(SERVER_VERSION),
+    'gui': openManagementGUI,
+    'csv': exportToCSV,
+    'sql': runSQL,
+}
+
 if __name__ == '__main__':
     # Parse the command line arguments
     argparse.ArgumentParser(description='ELERP Server')
@@ -565,57 +935,42 @@ if __name__ == '__main__':
     else:
         logger.info("Running in production mode") 
 
+    # Load resources, before the listeners start so the first requests can already use them
+    loadResources()
+    logger.info('Resource %s loaded', RESOURCES_PATH + 'data.json')
+
+    os.makedirs(WORKSHEET_PATH, exist_ok=True)
     initialize_sockets(LOCAL_IP, SOCKETS)
 
     broadcastListenerThread = createUDPThread(SOCKETS['udp'], udpService, stop)
     broadcastListenerThread.start()
-    logger.info(f'UDP boardcast listener started at {LOCAL_IP}:{SOCKETS['udp']}')
+    logger.info('UDP boardcast listener started at %s:%s', LOCAL_IP, SOCKETS['udp'])
+
+    databaseWriterThread = threading.Thread(target=databaseWriter, daemon=True)
+    databaseWriterThread.start()
+
+    clientSelectorThread, watchClient = createSelectorThread(clientHandler, stop, logger=logger)
+    clientSelectorThread.start()
 
     dedicatedListenerThread = createTCPThread(SOCKETS['tcp'], tcpService, stop)
     dedicatedListenerThread.start()
-    logger.info(f'TCP listener started at {LOCAL_IP}:{SOCKETS['tcp']}')
-
-    # Load resources
-    progRes = json.loads(open(RESOURCES_PATH + 'data.json', 'r',encoding='utf-8').read())
-    logger.info(f'Resource {RESOURCES_PATH + 'data.json'} loaded')
+    logger.info('TCP listener started at %s:%s', LOCAL_IP, SOCKETS['tcp'])
 
+    printConsoleMenu()
     while not stop.is_set():
-        print('\n\nELERP Server management console')
-        print('quit/exit --- Quit')
-        print('list --- List all clients')
-        print('message --- Show message')
-        print('reset --- Reset database')
-        print('version --- Show server version')
-        print('gui --- Database management tools')
-        print('csv --- Export database to csv')
-        print('sql --- Run SQL command')
-        command = input('Enter command: ')
-        if command == 'quit' or command == 'exit':
-            stop.set()
-            print('Stopping server... Please wait')
-        elif command == 'list':
-            print(addressbook)
-        elif command == 'message':
-            print(progRes)
-        elif command == 'reset':
-            db.resetDatabaseToDefault(DATABASE_PATH)
-        elif command == 'r_record':
-            db.resetRecordsTable(DATABASE_PATH)
-        elif command == 'version':
-            print(SERVER_VERSION)
-        elif command == 'gui':
-            print('Working in progress')
-            managementGUI()
-        elif command == 'csv':
-            exportToCSV()
-        elif command == 'sql':
-            try:
-                db.runSQLCommand(DATABASE_PATH, input('Enter SQL command: '))
-            except Exception as e:
-                print(e)
+        try:
+            command = input('Enter command: ')
+        except (EOFError, KeyboardInterrupt):
+            command = 'quit'    # The console is closed, stop the server instead of failing on every prompt
+        CONSOLE_COMMANDS.get(command.strip(), lambda: None)()
 
     print('Stopping broadcast listener thread...')
     broadcastListenerThread.join()
     print('Stopping dedicated listener thread...')
     dedicatedListenerThread.join()
+    print('Stopping client selector thread...')
+    clientSelectorThread.join()
+    print('Finishing queued database writes...')
+    databaseWrites.put((None, ()))
+    databaseWriterThread.join()
     sys.exit(0)
\ No newline at end of file
@@ -1,6 +1,6 @@
 ### Core Libraries ###
 from datetime import datetime
-import os, sys, time, base64
+import os, sys
 import configparser
 import argparse
 
@@ -16,7 +16,7 @@ from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QDragEnterEvent, QDropEvent, QIcon
 
 ### Helper Functions ###
-from src.helper import recvMessage, sendMessage
+from src.helper import recvMessage, sendMessage, sendFile, recvFile
 from src.protocol import STATUS, ExecutorScope, ProtocolHandler, REQUEST, RESPONSE
 from src.networking import searchServer, connectToServer
 
@@ -43,7 +43,8 @@ forms = None
 classes = None
 
 TIER = ['F1','F2','F3','F4','F5','F6','J','S','A']
-CLIENT_VERSION = '2.0.0'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+CLIENT_VERSION = '3.0.0'
 SERVER_UDP_PORT = 19864
 SERVER_TCP_PORT = 19865
 D_SERVER_UDP_PORT = 19866
@@ -53,14 +54,14 @@ def exceptionHook(exctype, value, traceback):
     logger.error(f'Uncaught exception: {exctype}, {value}, {traceback}')
     logger.info("Saving log to 'error.log'")
     with open('error.log', 'a') as f:
-        time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        time = datetime.now().strftime(TIMESTAMP_FORMAT)
         f.write(f'{time}: Uncaught exception: {exctype}, {value}, {traceback}\n')
     sys.__excepthook__(exctype, value, traceback)
 
 # Hook for excpetion
 sys.excepthook = exceptionHook
 
-def sendRequest(conn, request:str, scope: ExecutorScope=ExecutorScope.MESSAGE):
+def sendRequest(conn, request:str, scope: ExecutorScope=ExecutorScope.MESSAGE, file=None):
     """
     Send a request to the server and wait for replies.
 
@@ -68,11 +69,15 @@ def sendRequest(conn, request:str, scope: ExecutorScope=ExecutorScope.MESSAGE):
         conn: The connection object.
         request (str): The request message.
         scope (ExecutorScope): The scope of the of the reply message.
+        file: A file opened in binary mode, its content is sent after the request if given.
     Returns:
         ProtocolData: The response message.
     """
-    sendMessage(conn, request.encode())
-    response = handler.deserializeMessageAsProtocolData(recvMessage(conn).decode())
+    if file is None:
+        sendMessage(conn, request.encode())
+    else:
+        sendFile(conn, file, request.encode())  # The request and the file size go out in one send
+    response = handler.deserializeMessageAsProtocolData(recvMessage(conn))
     return {
         ExecutorScope.MESSAGE: response.getMessage(),
         ExecutorScope.RESPONSE: response.getType(),
@@ -261,24 +266,21 @@ class UploadWizard(QDialog):
         # Send the files to the server
         for i in range(num):
             file = self.ui.fileListWidget.item(i).data(Qt.UserRole)
+            createDate = datetime.fromtimestamp(os.path.getctime(file)).strftime(TIMESTAMP_FORMAT)
+            request = handler.prepMessage(REQUEST.POST, mainCommand='uploadWorksheet') \
+                .addAttribute('form', self.ui.formComboBox.currentIndex()) \
+                .addAttribute('subject', self.ui.subjectsComboBox.currentIndex()) \
+                .addAttribute('name', os.path.basename(file)) \
+                .addAttribute('description', self.ui.textEdit.toPlainText()) \
+                .addAttribute('creationDate', createDate) \
+                .serializeMessage()
             with open(file, 'rb') as f:
-                data = f.read()
-                createDate = datetime.strptime(time.ctime(os.path.getctime(file)), '%a %b %d %H:%M:%S %Y').strftime('%Y-%m-%d %H:%M:%S')
-                request = handler.prepMessage(REQUEST.POST, mainCommand='uploadWorksheet') \
-                    .addAttribute('fileData', data) \
-                    .addAttribute('form', self.ui.formComboBox.currentIndex()) \
-                    .addAttribute('subject', self.ui.subjectsComboBox.currentIndex()) \
-                    .addAttribute('name', os.path.basename(file)) \
-                    .addAttribute('description', self.ui.textEdit.toPlainText()) \
-                    .addAttribute('creationDate', createDate) \
-                    .serializeMessage()
-                response = sendRequest(conn, request) # This should return OK
-                
-                if response == STATUS.SUCCESS:
-                    logger.info(f'File {file} uploaded successfully')
-                else:
-                    logger.error(f'Error uploading file {file} with error code: {response}')    
-                f.close()
+                response = sendRequest(conn, request, file=f) # This should return OK, the file is streamed after the request
+            
+            if response == STATUS.SUCCESS:
+                logger.info(f'File {file} uploaded successfully')
+            else:
+                logger.error(f'Error uploading file {file} with error code: {response}')    
 
         super(UploadWizard, self).accept()
 
@@ -412,12 +414,18 @@ class RegisterWizard(QDialog):
             .addAttribute('section', self.ui.sectionCombox.currentIndex()) \
             .serializeMessage()
         try:
-            response = sendRequest(conn, request)  # This should return OK
+            response = sendRequest(conn, request)  # This should return OK, followed by the worksheet
+            if response != STATUS.SUCCESS:
+                raise ValueError(f'Worksheet {self.ui.worksheetEdit.text()} is not available on the server')
             try:
                 print(os.path.join(downloadFolderPath, self.ui.worksheetEdit.text()))
-                with open(os.path.join(downloadFolderPath, self.ui.worksheetEdit.text()), 'wb') as f:   # join the save path with the file name
-                    f.write(base64.b64decode(response))
-                    f.close()
+                try:
+                    f = open(os.path.join(downloadFolderPath, self.ui.worksheetEdit.text()), 'wb')   # join the save path with the file name
+                except OSError:
+                    recvFile(conn)    # The file still has to be read off the connection
+                    raise
+                with f:
+                    recvFile(conn, f)
                     logger.info(f'Worksheet {self.ui.worksheetEdit.text()} saved successfully')
                     QMessageBox.information(None, 'Success', f'Worksheet {self.ui.worksheetEdit.text()} saved successfully to {os.getcwd()}')
             except Exception as e:
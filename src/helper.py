@@ -1,5 +1,11 @@
 import struct
 
+# Bytes of a file received per read
+CHUNK_SIZE = 64 * 1024
+
+# The largest message recvMessage accepts, files are sent outside of messages so real messages stay far below it
+MAX_MESSAGE_SIZE = 8 * 1024 * 1024
+
 def recvAll(sock, numBytes):
     """
     Receive a fixed number of bytes from a socket.
@@ -11,14 +17,31 @@ def recvAll(sock, numBytes):
     Returns:
         bytearray: The bytes received.
     """
-    data = bytearray()
-    while len(data) < numBytes:
-        phoneix = sock.recv(numBytes - len(data))
+    # The buffer grows with the bytes that arrive, so a length that is never sent doesn't take the memory up front
+    data = bytearray(min(numBytes, CHUNK_SIZE))
+    received = 0
+    while received < numBytes:
+        if received == len(data):
+            data.extend(bytes(min(len(data), numBytes - received)))
+        with memoryview(data) as view:
+            phoneix = sock.recv_into(view[received:])
         if not phoneix:
             return None
-        data.extend(phoneix)
+        received += phoneix
     return data
 
+def frameMessage(message):
+    """
+    Prefix a message with its length, the way sendMessage sends it.
+
+    Args:
+        message (bytes): The message to frame.
+
+    Returns:
+        bytes: The length prefix followed by the message.
+    """
+    return struct.pack('>I', len(message)) + message
+
 def sendMessage(sock, message):
     """
     Send a message to the socket.
@@ -27,8 +50,7 @@ def sendMessage(sock, message):
         sock (socket): The socket to send the message to.
         message (dict): The message to send.
     """
-    message = struct.pack('>I', len(message)) + message
-    sock.sendall(message)
+    sock.sendall(frameMessage(message))
 
 def recvMessage(sock):
     """
@@ -39,9 +61,67 @@ def recvMessage(sock):
 
     Returns:
         bytearray: The message received.
+
+    Raises:
+        ConnectionError: If the message is larger than MAX_MESSAGE_SIZE, the connection is out of sync afterwards.
     """
     raw_message = recvAll(sock, 4)
     if not raw_message:
         return None
     messageLength = struct.unpack('>I', raw_message)[0]
-    return recvAll(sock, messageLength)
\ No newline at end of file
+    if messageLength > MAX_MESSAGE_SIZE:
+        raise ConnectionError(f'Message of {messageLength} bytes is larger than {MAX_MESSAGE_SIZE} bytes')
+    return recvAll(sock, messageLength)
+
+def sendFile(sock, file, message=None):
+    """
+    Send the content of a file as its size followed by the raw bytes.
+    The bytes are sent with socket.sendfile, which lets the kernel copy them straight from the file where supported.
+
+    Args:
+        sock (socket): The socket to send the file to.
+        file: The file object opened in binary mode to send, from its current position to the end.
+        message (bytes): A message to send in front of the file as sendMessage would, it goes out in the same send as the size.
+
+    Raises:
+        ConnectionError: If the file got shorter while it was sent, the connection is out of sync afterwards.
+    """
+    start = file.tell()
+    size = file.seek(0, 2) - start
+    file.seek(start)
+    header = struct.pack('>Q', size)
+    sock.sendall(header if message is None else frameMessage(message) + header)
+    if sock.sendfile(file, count=size) != size:
+        raise ConnectionError('File changed during file transfer')
+
+def recvFile(sock, file=None):
+    """
+    Receive a file sent by sendFile and write it to a file.
+    All bytes are read from the socket even if the file can't be written, so the connection stays in sync.
+
+    Args:
+        sock (socket): The socket to receive the file from.
+        file: The file object opened in binary mode to write the bytes to, the bytes are discarded if None.
+
+    Raises:
+        ConnectionResetError: If the connection is closed before the last byte.
+        OSError: If the file can't be written, raised after all bytes are received.
+    """
+    header = recvAll(sock, 8)
+    if header is None:
+        raise ConnectionResetError('Connection closed during file transfer')
+    remaining = struct.unpack('>Q', header)[0]
+    buffer = memoryview(bytearray(min(remaining, CHUNK_SIZE)))
+    error = None
+    while remaining:
+        received = sock.recv_into(buffer, min(remaining, len(buffer)))
+        if not received:
+            raise ConnectionResetError('Connection closed during file transfer')
+        remaining -= received
+        if file is not None and error is None:
+            try:
+                file.write(buffer[:received])
+            except OSError as e:
+                error = e
+    if error is not None:
+        raise error
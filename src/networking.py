@@ -1,5 +1,9 @@
+import os
 import socket
+import selectors
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from queue import SimpleQueue, Empty
 from typing import Callable
 
 from src.protocol import REQUEST, RESPONSE, ProtocolHandler, ProtocolData
@@ -9,6 +13,14 @@ handler = ProtocolHandler()
 # Type definition for the callback function that will be executed when a UDP message is received
 UDPCallback = Callable[[ProtocolData, tuple], None]
 TCPCallback = Callable[[socket.socket, tuple], None]
+# Type definition for the callback function that serves a readable connection, it returns whether the connection stays open
+SelectorCallback = Callable[[socket.socket, object], bool]
+
+# Kernel send and receive buffer of the TCP sockets, large enough to keep a worksheet transfer streaming
+SOCKET_BUFFER_SIZE = 1 << 20
+
+# Worker threads that serve the readable connections of a selector thread
+SELECTOR_WORKERS = 16
 
 def searchServer(serverPort, identifier, logger = None, timeout = 3):
     """
@@ -30,20 +42,20 @@ def searchServer(serverPort, identifier, logger = None, timeout = 3):
     message = handler.prepMessage(REQUEST.POST, mainCommand=identifier).serializeMessage()
 
     if logger:
-        logger.debug(f"Sending broadcast message: {message} to {serverPort}")
+        logger.debug("Sending broadcast message: %s to %s", message, serverPort)
     s.sendto(message.encode(), ('255.255.255.255', serverPort))
 
     # Wait for the server to respond
     s.settimeout(timeout)
     try:
         data, addr = s.recvfrom(4096)
-        response = handler.deserializeMessageAsProtocolData(data.decode())
+        response = handler.deserializeMessageAsProtocolData(data)
         if response.getType() != RESPONSE.OK:
             raise ValueError(f'Invalid response: {response.getType()}')
         
         if logger:
-            logger.debug(f"Received response from {addr}: {response}")
-            logger.info(f'Server found!')
+            logger.debug("Received response from %s: %s", addr, response)
+            logger.info('Server found!')
             return addr
     except socket.timeout:
         if logger:
@@ -57,10 +69,42 @@ def searchServer(serverPort, identifier, logger = None, timeout = 3):
             raise
     except ValueError as e:
         if logger:
-            logger.warning(f'Invalid response: {e}')
+            logger.warning('Invalid response: %s', e)
         return None, None
     s.close()
 
+def findLocalIP() -> str:
+    """
+    Find the ip address of the interface that leads to the local network, without a DNS lookup.
+    Connecting a UDP socket sends nothing, it only makes the system choose the outgoing interface.
+    Without a route for it (a network without a default gateway), the address of the host name is used instead.
+
+    Returns:
+        str: The ip address of the interface, or the loopback address if the host name can't be resolved either.
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        try:
+            s.connect(('10.255.255.255', 1))
+            return s.getsockname()[0]
+        except OSError:
+            pass
+    try:
+        return socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return '127.0.0.1'
+
+def tuneTCPSocket(sock: socket.socket):
+    """
+    Disable Nagle's algorithm so the small replies are sent at once, and enlarge the kernel buffers for the file transfers.
+    The buffers have to be set before the socket connects or listens to take effect on the TCP window.
+
+    Args:
+        sock (socket): The TCP socket to tune.
+    """
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+
 def connectToServer(serverIP, serverPort, logger = None, timeout = 3):
     """
     Establish a TCP connection with the server.
@@ -72,10 +116,11 @@ def connectToServer(serverIP, serverPort, logger = None, timeout = 3):
         conn: The connection object.
     """
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    tuneTCPSocket(s)
     s.settimeout(timeout)
     s.connect((serverIP, serverPort))
     if logger:
-        logger.info(f"Connected to server {serverIP}:{serverPort}")
+        logger.info("Connected to server %s:%s", serverIP, serverPort)
     return s
 
 
@@ -104,8 +149,8 @@ def createUDPThread(serverPort: int, action: UDPCallback, globalStopFlag: thread
             try:
                 conn, addr = SERVER_UDP_SOCKET.recvfrom(4096)
                 if logger:
-                    logger.info(f"Received message from {addr}: {conn} via UDP")
-                action(handler.deserializeMessageAsProtocolData(conn.decode()), addr)
+                    logger.info("Received message from %s: %s via UDP", addr, conn)
+                action(handler.deserializeMessageAsProtocolData(conn), addr)
             except socket.timeout:
                 continue
         SERVER_UDP_SOCKET.close()
@@ -113,7 +158,7 @@ def createUDPThread(serverPort: int, action: UDPCallback, globalStopFlag: thread
     udpListenerThread = threading.Thread(target = actionWrapper, args=(globalStopFlag,))
     udpListenerThread.daemon = True
     if logger:
-        logger.info(f"Starting UDP listener thread on port {serverPort}")
+        logger.info("Starting UDP listener thread on port %s", serverPort)
     return udpListenerThread
 
 
@@ -131,6 +176,9 @@ def createTCPThread(serverPort: int, action: TCPCallback, globalStopFlag: thread
         tcpThread: The thread object that listens for TCP messages.
     """
     SERVER_TCP_SOCKET = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if os.name != 'nt':
+        SERVER_TCP_SOCKET.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # On Windows this would let other sockets take over the port
+    tuneTCPSocket(SERVER_TCP_SOCKET)    # The accepted connections inherit the buffer sizes
     SERVER_TCP_SOCKET.bind(('', serverPort))
     SERVER_TCP_SOCKET.listen(5)
     SERVER_TCP_SOCKET.settimeout(3)
@@ -147,5 +195,83 @@ def createTCPThread(serverPort: int, action: TCPCallback, globalStopFlag: thread
     tcpListenerThread = threading.Thread(target = actionWrapper, args=(globalStopFlag,))
     tcpListenerThread.daemon = True
     if logger:
-        logger.info(f"Starting TCP listener thread")
-    return tcpListenerThread
\ No newline at end of file
+        logger.info("Starting TCP listener thread")
+    return tcpListenerThread
+
+
+def createSelectorThread(action: SelectorCallback, globalStopFlag: threading.Event, workers: int = SELECTOR_WORKERS, logger = None):
+    """
+    Create a thread that watches idle connections with a single selector.
+    A connection that becomes readable is taken off the selector and handed to a pool of worker threads,
+    which runs the action on it and gives it back to the selector afterwards, or closes it.
+    The action function should take two arguments: the connection and the data it was watched with.
+    Args:
+        action (SelectorCallback): The function to be executed when a connection is readable.
+        globalStopFlag (boolean): The flag to stop the thread.
+        workers (int): The number of worker threads. (default is SELECTOR_WORKERS)
+        logger (logging.Logger): The logger object. (default is None)
+    Returns:
+        tuple: The thread object that watches the connections, and the function to watch a connection with its data.
+    """
+    selector = selectors.DefaultSelector()
+    pending = SimpleQueue()
+
+    # The selector is only touched by its own thread, other threads queue the connections and wake it up
+    wakeReader, wakeWriter = socket.socketpair()
+    wakeReader.setblocking(False)
+    wakeWriter.setblocking(False)
+    selector.register(wakeReader, selectors.EVENT_READ)
+
+    def watch(conn: socket.socket, data):
+        pending.put((conn, data))
+        try:
+            wakeWriter.send(b'\0')
+        except OSError:
+            pass    # A wake up is already pending, or the thread is stopped
+
+    def serve(conn: socket.socket, data):
+        try:
+            keep = action(conn, data)
+        except Exception:
+            if logger:
+                logger.exception('Error while serving a connection')
+            keep = False
+        if keep and not globalStopFlag.is_set():
+            watch(conn, data)
+        else:
+            conn.close()
+
+    def actionWrapper(stop: threading.Event):
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            while not stop.is_set():
+                for key, _ in selector.select(timeout=3):
+                    if key.fileobj is wakeReader:
+                        try:
+                            while wakeReader.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                        while True:
+                            try:
+                                conn, data = pending.get_nowait()
+                            except Empty:
+                                break
+                            selector.register(conn, selectors.EVENT_READ, data)
+                    else:
+                        selector.unregister(key.fileobj)
+                        pool.submit(serve, key.fileobj, key.data)
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        while True:
+            try:
+                pending.get_nowait()[0].close()
+            except Empty:
+                break
+        selector.close()
+        wakeWriter.close()
+
+    selectorThread = threading.Thread(target = actionWrapper, args=(globalStopFlag,))
+    selectorThread.daemon = True
+    if logger:
+        logger.info("Starting selector thread with %s workers", workers)
+    return selectorThread, watch
@@ -37,6 +37,10 @@ class STATUS(Enum):
     INVALID_PARAMETER = 'invalid_parameter'
     UPLOAD_FAILED = 'upload_failed'
 
+# The characters a JSON document can start with, other strings in a message are plain text and are not parsed again
+# A quoted string counts as JSON, so a field such as '"abc"' is still decoded to abc as it was before the check
+JSON_START = frozenset(('{', '[', '"', '-', *'0123456789', 't', 'f', 'n', 'N', 'I', ' ', '\t', '\n', '\r'))
+
 class ProtocolEncoder(json.JSONEncoder):
     """
     The JSON encoder for the elerp network communication.
@@ -267,7 +271,7 @@ class ProtocolHandler():
         This method is used internally to deserialize the message.
 
         Args:
-            message (str): The message to be deserialized.
+            message (str | bytes): The message to be deserialized, bytes are read as UTF-8 without decoding them first.
 
         Returns:
             dict: The deserialized message.
@@ -277,12 +281,12 @@ class ProtocolHandler():
         message = json.loads(message, object_hook=protocolHook)
         return self.recursiveJSONParser(message)                                   # Then perform the recursive parsing and return the parsed data
     
-    def deserializeMessageAsProtocolData(self, message: str) -> ProtocolData:
+    def deserializeMessageAsProtocolData(self, message: Union[str, bytes]) -> ProtocolData:
         """
         Deserialize the message from JSON format and return it as a ProtocolData object.
 
         Args:
-            message (str): The message to be deserialized.
+            message (str | bytes): The message to be deserialized, a received frame can be passed as it is.
         
         Returns:
             data (ProtocolData): The deserialized message as a ProtocolData object.
@@ -307,7 +311,8 @@ class ProtocolHandler():
         for key in data:
             try:
                 if isinstance(data[key], str):
-                    data[key] = json.loads(data[key], object_hook=protocolHook)
+                    if data[key][:1] in JSON_START:
+                        data[key] = json.loads(data[key], object_hook=protocolHook)
                 elif isinstance(data[key], list):
                     for i in range(len(data[key])):
                         if isinstance(data[key][i], str):
@@ -328,6 +333,8 @@ class ProtocolExecutor():
 
     def __init__(self, message:ProtocolData=None ):
         self.message = message
+        self.handlers = {}
+        self.defaultHandler = None
 
     def setMessage(self, message:ProtocolData):
         """
@@ -386,23 +393,28 @@ class ProtocolExecutor():
         """
         Execute the registered action based on the message's request or response type.
         """
-        request_tuple = self.getMessageTuple()
+        return self.executeMessage(self.message, **kwargs)
+
+    def executeMessage(self, message: ProtocolData, **kwargs):
+        """
+        Execute the registered action for the given message, the message is not stored in the executor.
+        This way one executor can serve messages from several threads at once, the keyword arguments are passed on to the action.
+
+        Args:
+            message (ProtocolData): The message to execute.
+        """
+        request_tuple = (message.getType(), message.getCommand())
         if request_tuple in self.handlers:
-            scope = self.handlers[request_tuple][1]
-            action = self.handlers[request_tuple][0]
+            action, scope = self.handlers[request_tuple]
             if scope == ExecutorScope.MESSAGE:
-                return action(self.message.getMessage(), **kwargs)
+                return action(message.getMessage(), **kwargs)
             elif scope == ExecutorScope.WHOLE:
-                return action(self.message, **kwargs)
+                return action(message, **kwargs)
             elif scope == ExecutorScope.COMMAND:
-                return action(self.message.getCommand(), **kwargs)
+                return action(message.getCommand(), **kwargs)
             elif scope == ExecutorScope.RESPONSE:
-                return action(self.message.getType(), **kwargs)
+                return action(message.getType(), **kwargs)
         else:
             if not self.defaultHandler:
                 raise ValueError(f"No handler registered for {request_tuple}")
-            return self.defaultHandler(self.message, **kwargs)
-
-            
-        
-                                            
\ No newline at end of file
+            return self.defaultHandler(message, **kwargs)